@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
 from utils import *
-import socket, logging as log, asyncio, serial_asyncio
-from struct import unpack, pack
-from time import time
-from collections import defaultdict
-from math import sqrt
+import socket, logging, asyncio, serial_asyncio
+from struct import unpack, pack, unpack_from
+from time import time, perf_counter
+from collections import Counter
+from heapq import heappush, heappop, nlargest
+from itertools import count
+from math import sqrt, sin, pi
 from pythonosc.dispatcher import Dispatcher
 from pythonosc.osc_server import AsyncIOOSCUDPServer
 from pythonosc.udp_client import SimpleUDPClient
@@ -13,57 +15,186 @@ from types import SimpleNamespace as N
 from serial import Serial
 from serial.tools.list_ports import comports as serial_ports
 from random import random
-from dataclasses import dataclass, field
-from typing import Any, Awaitable
+from dataclasses import dataclass, field, fields
+from functools import cached_property
+from typing import Any, Awaitable, ClassVar
+from metrics import Registry, LoopLagMonitor
+from oscquery import OSCQuery
+try:
+    import numpy as np
+except ImportError:
+    np = None # optional, only needed by VelocityBasedNumpy
 D = dict
 
 
-# TODO: replace with proper class
-def log(*args, **kwargs):
-    print(*args, **kwargs)
+# per subsystem loggers, see utils.setup_logging
+# hot path only logs at debug level with deferred formatting
+log = logging.getLogger('haptics')
+log_ingest = logging.getLogger('haptics.ingest')
+log_behavior = logging.getLogger('haptics.behavior')
+log_controller = logging.getLogger('haptics.controller')
+log_connection = logging.getLogger('haptics.connection')
 
 
+@dataclass
 class Game:
+    # set by the Manager
+    metrics: ClassVar[Registry] = Registry()
+    clock = time
+    # path -> arrival timestamp of its newest update, filled as messages arrive
+    newest: dict[str, float] = field(default_factory=dict, init=False, repr=False, compare=False)
+
     async def start(self): pass
     async def disconnect(self) -> None: pass
     async def is_connected(self) -> bool: pass
+    # callback(path, value, at) with at the arrival timestamp
     def listen(self, path): pass
     def listen_distance(self, path): pass
+    def unlisten(self, path, wildcard_prefix=False): pass
+    # fast path: routes is full path (bytes) -> target, callback(target, distance, at) is sync
+    # returns False when unsupported, then listen_distance must be used instead
+    def listen_routes(self, prefix: str, routes: dict[bytes, Any], callback) -> bool: return False
+    # full paths of the parameters consumed, so the game may only send those
+    def advertise(self, paths: list[str]) -> None: pass
     async def send(self, path, value): pass
 
-# TODO: try OSC query
+
+# source: ingest (fast ingest, path under the prefix without route) or router (no route)
+UNRESOLVED_HELP = "OSC messages for unregistered paths, by where they were dropped"
+
+# minimal OSC decoder for the messages games send (single float/int/bool), bundles included
+# only registered paths are decoded, anything else is rejected by a prefix check first
+class OSCIngest(asyncio.DatagramProtocol):
+    def __init__(self, metrics: Registry, clock):
+        self.clock = clock
+        self.prefix = b'/'
+        self.routes: dict[bytes, Any] = {}
+        self.callback = None
+        self.messages = metrics.counter('osc_messages_total', "OSC messages received")
+        self.unresolved = metrics.counter('osc_unresolved_total', UNRESOLVED_HELP, source='ingest')
+
+    def datagram_received(self, data, addr):
+        try:
+            self.parse(data, self.clock())
+        except Exception as e:
+            asyncio.get_event_loop().call_exception_handler(D(
+                message=f"OSCIngest: failed to handle {data=}", exception=e))
+
+    def parse(self, data: bytes, at: float):
+        if data.startswith(b'#bundle\0'):
+            i = 16 # skip timetag
+            while i + 4 <= len(data):
+                (size,) = unpack_from('>i', data, i)
+                if size < 0 or i + 4 + size > len(data):
+                    log_ingest.debug("malformed bundle element size=%d at %d, dropped", size, i)
+                    return # the rest can't be trusted
+                self.parse(data[i+4:i+4+size], at)
+                i += 4 + size
+            return
+
+        self.messages.inc()
+        if not data.startswith(self.prefix):
+            return # not for us
+        end = data.find(b'\0')
+        target = self.routes.get(data[:end])
+        if target == None:
+            self.unresolved.inc()
+            return # not routed
+
+        # strings are null terminated and padded to 4 bytes
+        t = (end + 4) & ~3
+        tags_end = data.find(b'\0', t)
+        if data[t:t+1] != b',' or tags_end < t + 2:
+            return # no argument
+        i = (tags_end + 4) & ~3
+        match data[t+1]:
+            case 102: # f
+                (value,) = unpack_from('>f', data, i)
+            case 105: # i
+                (value,) = unpack_from('>i', data, i)
+            case 84: # T
+                value = 1.
+            case 70: # F
+                value = 0.
+            case _:
+                return # unsupported
+        self.callback(target, value, at)
+
 @dataclass
 class VRChat(Game):
     hostname: str = '127.0.0.1'
     sending_port: int = 9000
     receiving_port: int = 9001
+    fast_ingest: bool = False # native OSC decoding, only routed parameters
+    # advertise the routed parameters over OSCQuery, the game only sends those
+    # to a port chosen by the system instead of receiving_port
+    oscquery: bool = False
+    service_name: str = 'DakyHaptics'
 
     async def start(self):
         self.client = SimpleUDPClient(self.hostname, self.sending_port)
-        self.dispatcher = Dispatcher()
+        self.handlers = {} # path -> dispatcher handler, see unlisten
         self.event_loop = asyncio.get_event_loop()
-        self.server = AsyncIOOSCUDPServer((self.hostname, self.receiving_port),
-                                          self.dispatcher, self.event_loop)
-        self.transport, _ = await self.server.create_serve_endpoint()
+        self.query: OSCQuery = None
+        port = 0 if self.oscquery else self.receiving_port
+        if self.fast_ingest:
+            self.ingest = OSCIngest(self.metrics, self.clock)
+            self.transport, _ = await self.event_loop.create_datagram_endpoint(
+                    lambda: self.ingest,
+                    local_addr=(self.hostname, port))
+        else:
+            self.dispatcher = Dispatcher()
+            self.server = AsyncIOOSCUDPServer((self.hostname, port),
+                                              self.dispatcher, self.event_loop)
+            self.transport, _ = await self.server.create_serve_endpoint()
+        self.port = self.transport.get_extra_info('sockname')[1] # actual one
+
+        if self.oscquery:
+            self.query = OSCQuery(f"{self.service_name}-{self.port}", self.hostname, self.port, self.hostname)
+            await self.query.start()
 
     async def disconnect(self) -> None:
+        if self.query:
+            await self.query.stop()
         self.transport.close()
 
+    def advertise(self, paths: list[str]) -> None:
+        if self.query:
+            self.query.update(paths)
+
     async def is_connected(self) -> bool:
         return not self.transport.is_closing()
 
     def listen(self, path: str, callback: Awaitable, wildcard_prefix=False):
+        if self.fast_ingest:
+            raise Exception("VRChat.listen unsupported with fast_ingest, use listen_routes")
         if wildcard_prefix: path += '*' # wildcard listen
         # workaround because asyncio DatagramProtocol doesn't support Awaitable callback
         def f(path: str, value: Any):
-            self.event_loop.create_task(callback(path, value))
-        self.dispatcher.map(path, f)
+            at = self.newest[path] = self.clock() # called as the datagram arrives
+            self.event_loop.create_task(callback(path, value, at))
+        self.handlers[path] = self.dispatcher.map(path, f)
+
+    def unlisten(self, path: str, wildcard_prefix=False):
+        if wildcard_prefix: path += '*'
+        if (handler := self.handlers.pop(path, None)):
+            self.dispatcher.unmap(path, handler)
 
     def listen_distance(self, path: str, callback: Awaitable, wildcard_prefix=False):
-        async def f(path: str, proximity: float):
-            await callback(path, 1 - proximity) # convert from vrc proximity to distance
+        async def f(path: str, proximity: float, at: float):
+            await callback(path, 1 - proximity, at) # convert from vrc proximity to distance
         self.listen(path, f, wildcard_prefix)
 
+    def listen_routes(self, prefix: str, routes: dict[bytes, Any], callback) -> bool:
+        if not self.fast_ingest:
+            return False
+        def f(target: Any, proximity: float, at: float):
+            callback(target, 1 - proximity, at) # convert from vrc proximity to distance
+        self.ingest.prefix = prefix.encode()
+        self.ingest.routes = routes
+        self.ingest.callback = f
+        return True
+
     async def send(self, path: str, value: float):
         self.client.send_message(path, value)
 
@@ -74,6 +205,12 @@ class VRChat(Game):
 @dataclass
 class Protocol:
     def actuation(self, address, value) -> bytes: pass
+    # batched version of actuation, None when unsupported (fallback to one per address)
+    def actuations(self, values: dict[Any, float]) -> bytes: return None
+    # frame protocols encode the whole controller state at once instead: levels of
+    # every actuator indexed by address (0 to frame_size - 1)
+    def frame_size(self) -> int: return None
+    def frame(self, levels) -> bytes: pass
     def query_battery(self) -> bytes: pass
     def parse_incoming(self, data: bytes) -> dict: pass
 
@@ -83,6 +220,14 @@ class DakyProtocol(Protocol):
     def actuation(self, address, value: float) -> bytes:
         value = int(remap_clamp(value, 0, 1, 0, 255))
         return b"B" + pack("<BB", address, value)
+    def actuations(self, values: dict[Any, float]) -> bytes:
+        # format: M + count: uint8 + (address: uint8, value: uint8) * count
+        data = bytearray(b"M")
+        data.append(len(values))
+        for address, value in values.items():
+            data.append(address)
+            data.append(int(remap_clamp(value, 0, 1, 0, 255)))
+        return bytes(data)
     def query_battery(self) -> bytes:
         return b"%"
     def parse_incoming(self, data: bytes) -> dict:
@@ -96,44 +241,282 @@ class DakyProtocol(Protocol):
                 raise Exception(f"Unsupported: {data=}")
 
 
-class SenseShiftProtocol(Protocol): pass
+# whole frame of motor levels for vest style devices (bHaptics like, many motors):
+# format of this project, not a SenseShift wire format, the firmware has to implement it:
+# F + count: uint8 + levels, two motors per byte (high nibble first) at depth 4
+# or one per byte at depth 8; packed into a preallocated buffer, vectorized with numpy
+@dataclass
+class SenseShiftProtocol(Protocol):
+    motors: int = 40
+    depth: int = 4 # bits per motor level, 4 or 8
+
+    def __post_init__(self):
+        if self.depth not in (4, 8):
+            raise Exception(f"SenseShiftProtocol depth {self.depth} unsupported, expected 4 or 8")
+        if not isinstance(self.motors, int) or not 1 <= self.motors <= 255:
+            raise Exception(f"SenseShiftProtocol motors {self.motors} unsupported, expected 1 to 255 (count is one byte)")
+        self.top = (1 << self.depth) - 1
+        per_byte = 8 // self.depth
+        size = -(-self.motors // per_byte)
+        if 2 + size > 255: # serial packets are prefixed by their size: uint8
+            raise Exception(f"SenseShiftProtocol {self.motors} motors at depth {self.depth} make a "
+                            f"{2 + size} bytes frame, 255 at most (253 motors at depth 8)")
+        self.buffer = bytearray(b"F" + pack("<B", self.motors) + bytes(size))
+        if np is not None:
+            self.payload = np.frombuffer(self.buffer, dtype=np.uint8)[2:]
+            self.scaled = np.zeros(size * per_byte) # padded to whole bytes
+            self.quantized = np.zeros(size * per_byte, dtype=np.uint8)
+
+    def frame_size(self) -> int:
+        return self.motors
+
+    def frame(self, levels) -> bytes:
+        if np is None:
+            q = [ round(clamp(v, 0, 1) * self.top) for v in levels ]
+            if self.depth == 4:
+                q.append(0) # odd count padding, ignored by zip otherwise
+                q = [ (a << 4) | b for a, b in zip(q[0::2], q[1::2]) ]
+            self.buffer[2:] = bytes(q)
+            return bytes(self.buffer)
+
+        scaled, q = self.scaled, self.quantized
+        np.multiply(levels, self.top, out=scaled[:self.motors])
+        np.clip(scaled, 0, self.top, out=scaled)
+        np.rint(scaled, out=scaled)
+        q[:] = scaled
+        if self.depth == 4:
+            np.left_shift(q[0::2], 4, out=self.payload)
+            np.bitwise_or(self.payload, q[1::2], out=self.payload)
+        else:
+            self.payload[:] = q
+        return bytes(self.buffer)
 
+    def query_battery(self) -> bytes:
+        return b"%"
+    def parse_incoming(self, data: bytes) -> dict:
+        if data[0:1] == b'%':
+            cmd, value = unpack('<cH', data)
+            return D(type='battery_value', value=value)
+        raise Exception(f"Unsupported: {data=}")
+
+
+# outbound stage of a connection: data is written directly until the transport
+# signals backpressure, then it's held per key (latest wins) in a bounded buffer
+class Outbox:
+    def __init__(self, max_pending: int):
+        self.write = None # set once the transport exists
+        self.max_pending = max_pending
+        self.paused = False
+        self.pending: dict[Any, bytes] = {} # key -> data, oldest first
+        self.seq = count() # unique keys for unkeyed data
+        self.counters = Counter() # overwritten, dropped
+        # set by the Controller: on_write(data) once written, on_drop(key) when
+        # dropped without being written (None for unkeyed data)
+        self.on_write = None
+        self.on_drop = None
+
+    def send(self, data: bytes, key: Any = None) -> None:
+        if not self.paused:
+            self.write_data(data)
+            return
+
+        if key == None:
+            key = (None, next(self.seq)) # can't be overwritten
+        if self.pending.pop(key, None) != None:
+            # latest goes last: written after older data (eg: a batch) of the same address
+            self.counters['overwritten'] += 1
+        elif len(self.pending) >= self.max_pending:
+            oldest = next(iter(self.pending))
+            del self.pending[oldest]
+            self.counters['dropped'] += 1
+            if self.on_drop:
+                self.on_drop(None if type(oldest) is tuple and oldest[0] == None else oldest)
+        self.pending[key] = data
+
+    def write_data(self, data: bytes) -> None:
+        self.write(data)
+        if self.on_write:
+            self.on_write(data)
+
+    def pause(self) -> None:
+        self.paused = True
+
+    def resume(self) -> None:
+        self.paused = False
+        # writing may pause again, keep the rest for next resume
+        while self.pending and not self.paused:
+            self.write_data(self.pending.pop(next(iter(self.pending))))
 
+
+@dataclass
 class Connection:
+    # outbound flow control
+    max_pending: int = field(default=64, kw_only=True) # updates held while paused
+    write_buffer: int = field(default=256, kw_only=True) # bytes, transport high water mark
+    connect_timeout: float = field(default=10, kw_only=True) # seconds, then the controller is left offline
+
     async def connect(self, loop, on_receive: Awaitable, on_error: Awaitable) -> None: pass
     async def disconnect(self) -> None: pass
     async def is_connected(self) -> bool: pass
-    async def send(self, data: bytes) -> None: pass
+    # key identifies what data updates (eg: actuator address), only the latest is kept under load
+    async def send(self, data: bytes, key: Any = None) -> None:
+        self.outbox.send(data, key)
+
+    def new_outbox(self) -> Outbox:
+        self.outbox = Outbox(self.max_pending)
+        return self.outbox
+
+    def set_writer(self, write) -> None:
+        self.outbox.write = write
+        self.transport.set_write_buffer_limits(high=self.write_buffer, low=self.write_buffer // 4)
+
+
+# single unconnected socket for all shared UDP connections: incoming datagrams are
+# dispatched by source address, outgoing ones queued during a loop iteration are
+# written together once it ends (Python has no sendmmsg, still one sendto each)
+class UDPPool(asyncio.DatagramProtocol):
+    pools: dict = {} # loop -> Task[UDPPool]
+
+    @classmethod
+    async def get(cls, loop, write_buffer: int) -> 'UDPPool':
+        pool = cls.pools.get(loop)
+        if pool == None:
+            pool = cls.pools[loop] = loop.create_task(cls(loop).start(write_buffer))
+        try:
+            # shielded: a connect timing out doesn't cancel it for the others
+            return await asyncio.shield(pool)
+        except BaseException:
+            if pool.done() and cls.pools.get(loop) is pool:
+                del cls.pools[loop] # failed or cancelled, the next one retries
+            raise
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.transport = None
+        self.connections: dict[tuple[str, int], 'UDP'] = {} # (ip, port) -> connection
+        self.hosts: dict[str, 'UDP'] = {} # ip -> connection, for replies from another port
+        self.queue: list[tuple[bytes, tuple[str, int]]] = []
+
+    async def start(self, write_buffer: int) -> 'UDPPool':
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: self, local_addr=('0.0.0.0', 0), family=socket.AF_INET)
+        self.transport.set_write_buffer_limits(high=write_buffer, low=write_buffer // 4)
+        return self
+
+    def add(self, connection: 'UDP') -> None:
+        remote = (connection.hostname, connection.port)
+        self.connections[remote] = connection
+        self.hosts[connection.hostname] = connection
+
+    def remove(self, connection: 'UDP') -> None:
+        self.connections.pop((connection.hostname, connection.port), None)
+        if self.hosts.get(connection.hostname) is connection:
+            del self.hosts[connection.hostname]
+        if not self.connections:
+            self.flush()
+            self.transport.close()
+            self.pools.pop(self.loop, None)
+
+    def sendto(self, data: bytes, remote: tuple[str, int]) -> None:
+        if not self.queue:
+            self.loop.call_soon(self.flush)
+        self.queue.append((data, remote))
+
+    def flush(self) -> None:
+        queue, self.queue = self.queue, []
+        sendto = self.transport.sendto
+        for data, remote in queue:
+            sendto(data, remote)
+
+    def datagram_received(self, data, addr):
+        log_connection.debug("UDPPool.datagram_received data=%r addr=%r", data, addr)
+        c = self.connections.get(addr[:2]) or self.hosts.get(addr[0])
+        if c == None:
+            log_connection.debug("UDPPool: datagram from unknown addr=%r", addr)
+            return
+        self.loop.create_task(c.on_receive(data))
+    def error_received(self, exc):
+        # can't tell which device caused it
+        log_connection.warning("UDPPool.error_received exc=%r", exc)
+        for c in self.connections.values():
+            self.loop.create_task(c.on_error(exc))
+    def pause_writing(self):
+        for c in self.connections.values():
+            c.outbox.pause()
+    def resume_writing(self):
+        for c in self.connections.values():
+            c.outbox.resume()
 
 
 @dataclass
 class UDP(Connection):
     address: str
     port: int
+    shared: bool = False # use the UDPPool socket instead of its own
 
     async def connect(self, loop, on_receive, on_error) -> None:
-        self.hostname = socket.gethostbyname(self.address)
-        if not self.hostname:
+        # resolved by the loop, doesn't block other controllers connecting
+        infos = await loop.getaddrinfo(self.address, self.port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        if not infos:
             raise Exception(f"Couldn't resolve hostname: {self.address}")
+        self.hostname = infos[0][4][0]
+
+        outbox = self.new_outbox()
+        if self.shared:
+            self.on_receive, self.on_error = on_receive, on_error
+            self.pool = await UDPPool.get(loop, self.write_buffer)
+            self.pool.add(self)
+            self.transport = self.pool.transport
+            remote, sendto = (self.hostname, self.port), self.pool.sendto
+            outbox.write = lambda data: sendto(data, remote)
+            return
 
         class Receiver(asyncio.DatagramProtocol):
             def datagram_received(self, data, addr):
-                log(f"UDP.datagram_received {data=} {addr=}") # TODO
+                log_connection.debug("UDP.datagram_received data=%r addr=%r", data, addr)
                 loop.create_task(on_receive(data))
             def error_received(self, exc):
-                log(f"UDP.error_received {exc=}") # TODO
+                log_connection.warning("UDP.error_received exc=%r", exc)
                 loop.create_task(on_error(exc))
+            def pause_writing(self):
+                outbox.pause()
+            def resume_writing(self):
+                outbox.resume()
         self.transport, self.receiver = await loop.create_datagram_endpoint(
                 Receiver,
                 remote_addr=(self.hostname, self.port))
+        self.set_writer(self.transport.sendto)
     async def disconnect(self) -> None:
-        self.transport.close()
+        if self.shared:
+            self.pool.remove(self)
+        else:
+            self.transport.close()
     async def is_connected(self) -> bool:
         return not self.transport.is_closing() # TODO: can't know, UDP is stateless
-    async def send(self, data: bytes) -> None:
-        log(f"UDP.send {data=}") # TODO
-        self.transport.sendto(data)
-
+    async def send(self, data: bytes, key: Any = None) -> None:
+        log_connection.debug("UDP.send data=%r", data)
+        self.outbox.send(data, key)
+
+
+SIZE_PREFIXES = [ pack('<B', n) for n in range(256) ]
+
+# USB enumeration is slow: done once in a thread and shared by the
+# SerialUSB connecting at the same time, refreshed when older than max_age
+_ports: tuple[float, asyncio.Future] = (0, None)
+
+async def list_serial_ports(loop, max_age: float = 5) -> list:
+    global _ports
+    at, ports = _ports
+    if ports == None or perf_counter() - at > max_age:
+        ports = loop.run_in_executor(None, serial_ports)
+        _ports = (perf_counter(), ports)
+    try:
+        # shielded: a connect timing out doesn't cancel it for the others
+        return await asyncio.shield(ports)
+    except BaseException:
+        if ports.done() and _ports[1] is ports:
+            _ports = (0, None) # don't cache the failure (or cancellation)
+        raise
 
 @dataclass
 class SerialUSB(Connection):
@@ -141,40 +524,57 @@ class SerialUSB(Connection):
     serial_number: str
     baudrate: int = 115200
     timeout: float = 5
+    device: str = None # explicit port (eg: /dev/ttyUSB0), skips the search
 
-    def search_device(self):
+    async def search_device(self, loop):
         return next(( s
-                     for s in serial_ports()
-                     if s.product == s.product
-                     if s.serial_number == s.serial_number ), None)
+                     for s in await list_serial_ports(loop)
+                     if s.product == self.product
+                     if s.serial_number == self.serial_number ), None)
 
     # TODO: unused on_error
     async def connect(self, loop, on_receive, on_error) -> None:
-        s = self.search_device()
+        s = N(device=self.device) if self.device else await self.search_device(loop)
         if s == None:
             raise Exception(f"Couldn't connect to {self.product} {self.serial_number}")
 
+        async def receive_all(frames: list[bytes]):
+            for frame in frames:
+                await on_receive(frame)
+
+        outbox = self.new_outbox()
         class Receiver(asyncio.Protocol):
             def __init__(self, *args, **kwargs):
                 super().__init__(*args, **kwargs)
-                self.buffer = b''
-                self.bytes_to_read = 0
+                self.buffer = bytearray()
+                self.offset = 0 # start of unread data
             def data_received(self, data):
                 # expected format made of packets: size: uint8 + data
                 # split into packets and only send when complete
-                self.buffer += data
-                while True:
-                    if self.bytes_to_read:
-                        if len(self.buffer) >= self.bytes_to_read:
-                            loop.create_task(on_receive(self.buffer[:self.bytes_to_read]))
-                            self.buffer = self.buffer[self.bytes_to_read:]
-                            self.bytes_to_read = 0
-
-                    if not self.bytes_to_read and len(self.buffer) > 0:
-                        (self.bytes_to_read,) = unpack('<B', self.buffer[0:1])
-                        self.buffer = self.buffer[1:]
-                    else:
-                        break
+                buffer = self.buffer
+                buffer += data
+                i, n = self.offset, len(buffer)
+                frames = []
+                with memoryview(buffer) as view:
+                    while i < n and i + 1 + buffer[i] <= n:
+                        size = buffer[i]
+                        if size:
+                            frames.append(bytes(view[i+1:i+1+size]))
+                        i += 1 + size
+                # compact only once most of the buffer was consumed
+                if i == n:
+                    buffer.clear()
+                    i = 0
+                elif i > n // 2:
+                    del buffer[:i]
+                    i = 0
+                self.offset = i
+                if frames:
+                    loop.create_task(receive_all(frames))
+            def pause_writing(self):
+                outbox.pause()
+            def resume_writing(self):
+                outbox.resume()
         self.transport, self.receiver = await serial_asyncio.create_serial_connection(
                 loop,
                 Receiver,
@@ -184,6 +584,7 @@ class SerialUSB(Connection):
                 write_timeout = self.timeout,
                 xonxoff = 0, rtscts = 0
                 )
+        self.set_writer(self.write)
 
     async def disconnect(self) -> None:
         self.transport.close()
@@ -191,15 +592,216 @@ class SerialUSB(Connection):
     async def is_connected(self) -> bool:
         return not self.transport.is_closing()
 
-    async def send(self, data: bytes) -> None:
-        # add size prefix of the packet for serial
-        self.transport.write(pack('<B', len(data)) + data)
+    def write(self, data: bytes) -> None:
+        # add size prefix of the packet for serial, the transport joins its buffer anyway
+        self.transport.write(SIZE_PREFIXES[len(data)])
+        self.transport.write(data)
 
 
 #class Bluetooth(Connection): pass
 
 
-@dataclass
+# single timer for all deadlines (timeouts, throttles, flushes): a heap of absolute
+# timestamps with lazy cancellation, rescheduling a key just supersedes its old entry.
+# Postponing (eg: a timeout pushed back on every update) doesn't add heap entries,
+# the existing one is pushed again when it comes due. A key cancelled or moved earlier
+# leaves its old entry behind until it reaches the top, so a key may have several
+class Scheduler:
+    def __init__(self, clock=time):
+        self.clock = clock # behaviors and controllers read the time from here
+        self.virtual = False # time only moves by advance(), no loop timers
+        self.heap: list = [] # (at, seq, key)
+        self.deadlines: dict[Any, tuple] = {} # key -> live (at, f, args)
+        self.seq = count() # tie breaker, keeps insertion order
+        self.handle: asyncio.TimerHandle = None
+        self.armed_at: float = None
+
+    def schedule(self, key: Any, at: float, f: Awaitable, *args) -> None:
+        old = self.deadlines.get(key)
+        self.deadlines[key] = (at, f, args)
+        if old != None and old[0] <= at:
+            return # postponed, its entry is still in the heap
+        heappush(self.heap, (at, next(self.seq), key))
+        if self.handle == None or at < self.armed_at:
+            self.arm(at)
+
+    def cancel(self, key: Any) -> None:
+        self.deadlines.pop(key, None)
+
+    def pending(self, key: Any) -> bool:
+        return key in self.deadlines
+
+    def arm(self, at: float) -> None:
+        if self.virtual:
+            return
+        if self.handle:
+            self.handle.cancel()
+        loop = asyncio.get_event_loop()
+        self.armed_at = at
+        self.handle = loop.call_later(max(0, at - self.clock()), self.run_pass)
+
+    # pops the entry on top of the heap: its (f, args) when due, None when stale or postponed
+    def pop(self):
+        at, _, key = heappop(self.heap)
+        live = self.deadlines.get(key)
+        if live == None or live[0] < at:
+            return None # cancelled, or rescheduled earlier (has its own entry)
+        if live[0] > at:
+            heappush(self.heap, (live[0], next(self.seq), key)) # postponed
+            return None
+        del self.deadlines[key]
+        return live
+
+    def run_pass(self) -> None:
+        self.handle = None
+        now = self.clock()
+        heap = self.heap
+        due = []
+        while heap and heap[0][0] <= now:
+            if (live := self.pop()) != None:
+                due.append(live)
+        # settle stale and postponed entries on top to avoid useless wake ups
+        while heap:
+            live = self.deadlines.get(heap[0][2])
+            if live != None and live[0] == heap[0][0]:
+                break
+            self.pop()
+        if heap:
+            self.arm(heap[0][0])
+        if due:
+            asyncio.get_event_loop().create_task(self.fire(due))
+
+    # already popped: one failing (eg: a timeout) mustn't prevent the others
+    async def fire(self, due: list) -> None:
+        for _, f, args in due:
+            try:
+                await f(*args)
+            except Exception as e:
+                asyncio.get_event_loop().call_exception_handler(D(
+                    message=f"Scheduler: {getattr(f, '__qualname__', f)} failed", exception=e))
+
+    # virtual time: run every deadline up to until in order, the clock follows
+    async def advance(self, until: float) -> None:
+        heap = self.heap
+        while heap and heap[0][0] <= until:
+            if (live := self.pop()) != None:
+                at, f, args = live
+                self.clock.now = at
+                await f(*args)
+        self.clock.now = until
+
+
+class VirtualClock:
+    def __init__(self, now: float = 0):
+        self.now = now
+    def __call__(self) -> float:
+        return self.now
+
+
+# smoothing of velocity samples, O(1) memory and time per sample
+# slotted like other per actuator state, subclasses declare their fields
+class Smoothing:
+    __slots__ = ('count',) # samples since last flush
+    def add(self, v: float) -> None: pass
+    def value(self) -> float: pass
+    def flush(self) -> None: self.count = 0 # after actuation
+    def reset(self) -> None: self.count = 0 # after a stall
+
+
+# average of samples since last actuation
+@dataclass(slots=True)
+class Average(Smoothing):
+    sum: float = field(init=False, compare=False)
+    def __post_init__(self):
+        self.reset()
+    def add(self, v: float) -> None:
+        self.sum += v
+        self.count += 1
+    def value(self) -> float:
+        return self.sum / self.count
+    def flush(self) -> None:
+        self.sum = 0.
+        self.count = 0
+    def reset(self) -> None:
+        self.flush()
+
+
+# exponential moving average, continuous across actuations
+@dataclass(slots=True)
+class EMA(Smoothing):
+    alpha: float = 0.3 # weight of new samples
+    ema: float = field(init=False, compare=False)
+    def __post_init__(self):
+        if not 0 < self.alpha <= 1:
+            raise Exception(f"EMA alpha {self.alpha} unsupported, expected 0 < alpha <= 1")
+        self.reset()
+    def add(self, v: float) -> None:
+        self.ema = v if self.ema == None else self.ema + self.alpha * (v - self.ema)
+        self.count += 1
+    def value(self) -> float:
+        return self.ema
+    def reset(self) -> None:
+        self.ema = None
+        self.count = 0
+
+
+# moving average over the last samples, ring buffer with running sum
+@dataclass(slots=True)
+class Window(Smoothing):
+    size: int = 8
+    ring: list[float] = field(init=False, compare=False)
+    pos: int = field(init=False, compare=False)
+    filled: int = field(init=False, compare=False)
+    sum: float = field(init=False, compare=False)
+    def __post_init__(self):
+        if not isinstance(self.size, int) or self.size < 1:
+            raise Exception(f"Window size {self.size} unsupported, expected at least 1")
+        self.reset()
+    def add(self, v: float) -> None:
+        if self.filled == self.size:
+            self.sum -= self.ring[self.pos]
+        else:
+            self.filled += 1
+        self.ring[self.pos] = v
+        self.sum += v
+        self.pos = (self.pos + 1) % self.size
+        if self.pos == 0:
+            self.sum = sum(self.ring) # once per round, avoid float drift
+        self.count += 1
+    def value(self) -> float:
+        return self.sum / self.filled
+    def reset(self) -> None:
+        self.ring = [0.] * self.size
+        self.pos = 0
+        self.filled = 0
+        self.sum = 0.
+        self.count = 0
+
+
+# maximum since last actuation, or decaying peak per sample if decay is set
+@dataclass(slots=True)
+class PeakHold(Smoothing):
+    decay: float = None # 0-1 factor
+    peak: float = field(init=False, compare=False)
+    def __post_init__(self):
+        if self.decay is not None and not 0 <= self.decay <= 1:
+            raise Exception(f"PeakHold decay {self.decay} unsupported, expected 0 <= decay <= 1")
+        self.reset()
+    def add(self, v: float) -> None:
+        self.peak = max(v, self.peak * (1 if self.decay is None else self.decay))
+        self.count += 1
+    def value(self) -> float:
+        return self.peak
+    def flush(self) -> None:
+        if self.decay is None:
+            self.peak = 0.
+        self.count = 0
+    def reset(self) -> None:
+        self.peak = 0.
+        self.count = 0
+
+
+@dataclass(slots=True)
 class Actuator:
     name: str
     min: float = 0.0
@@ -208,26 +810,126 @@ class Actuator:
     # handlded by behaviors
     collider_scaler: float = 5 # velocity only
     throttle: Any = None
+    smoothing: Any = None # velocity only, eg: { type: EMA, alpha: 0.3 }
+    effect: str = None # waveform only, name of the effect played on contact
+    # [x, y, z]: virtual actuators without weights are spread over the nearest physical ones
+    position: list[float] = None
+
+    def __post_init__(self):
+        self.new_smoothing() # validate early
+
+    def new_smoothing(self) -> Smoothing:
+        if not self.smoothing:
+            return Average()
+        kwargs = dict(self.smoothing)
+        c = globals().get(kwargs.pop('type', None))
+        if not isinstance(c, type) or not issubclass(c, Smoothing):
+            raise Exception(f"Actuator {self.name} invalid smoothing {self.smoothing}")
+        return c(**kwargs)
 
     def map(self, value: float) -> float:
         if value < self.min_sensitivity:
             return 0.
+        if self.min_sensitivity >= 1:
+            return self.max # no range left
         return remap_clamp(value, self.min_sensitivity, 1, self.min, self.max)
 
 
+# stage between the behavior and the controller output enforcing max_concurrent:
+# only the top N requested actuators run, others are preempted (sent 0) and
+# restored with their latest value once they're back in the top N
+class Limiter:
+    STICKINESS = 1.1 # running actuators keep their slot against slightly stronger ones
+
+    def __init__(self, max_concurrent: int, priority: str = 'intensity'):
+        if priority not in ('intensity', 'recency'):
+            raise Exception(f"Unknown priority {priority}, expected intensity or recency")
+        self.max_concurrent = max_concurrent
+        self.priority = priority
+        # address -> (intensity, timestamp, value), running or not
+        self.requested: dict[Any, tuple[float, float, float]] = {}
+        self.active: set = set() # addresses allowed to run
+        self.counters = Counter() # preempted, restored, denied
+
+    def rank(self, address: Any) -> tuple:
+        intensity, at, _ = self.requested[address]
+        if address in self.active:
+            intensity *= self.STICKINESS
+        return (intensity, at) if self.priority == 'intensity' else (at, intensity)
+
+    # value went through Actuator.map, intensity is the behavior one before (default: value):
+    # a slot is only taken by a non zero intensity, an actuator with min > 0 maps 0 to min
+    # returns the (address, value) to output
+    def request(self, address: Any, value: float, at: float, intensity: float = None) -> list[tuple[Any, float]]:
+        if intensity == None:
+            intensity = value
+        requested = self.requested
+        if intensity > 0:
+            requested[address] = (intensity, at, value)
+        else:
+            requested.pop(address, None)
+        if len(requested) <= self.max_concurrent:
+            active = set(requested)
+        else:
+            active = set(nlargest(self.max_concurrent, requested, key=self.rank))
+
+        out = []
+        for a in self.active - active:
+            if a in requested: # still wanted but outranked
+                self.counters['preempted'] += 1
+                out.append((a, 0.))
+        for a in active - self.active:
+            if a != address:
+                self.counters['restored'] += 1
+                out.append((a, requested[a][2]))
+        # released, or just preempted (already sent 0 above)
+        if address in active or (intensity <= 0 and address in self.active):
+            out.append((address, value))
+        elif intensity > 0:
+            self.counters['denied'] += 1
+        self.active = active
+        return out
+
+
+GOOD_RTT = 0.02 # seconds, links faster than this get full rate
+PROBE_SMOOTHING = 0.2 # weight of the latest probe in rtt and loss
+
 @dataclass
 class Controller:
     name: str # must be unique
     address_to_actuator: dict[Any, Actuator]
     protocol: Protocol
     connection: Connection
+    on_battery: bool = False # battery powered, its level is reported from the probe replies
     # TODO: not handled yet
-    on_battery: bool = False
     inverted_values: bool = False
-    max_concurrent: int = None
+    max_concurrent: int = None # actuators running at once, see Limiter
+    priority: str = 'intensity' # or recency, which ones run when over max_concurrent
+    coalesce: float = None # seconds, gather updates and send one packet per tick
+    dedup: bool = True # skip sending the same encoded value again
+    keepalive: float = 1.0 # seconds, resend unchanged values after this delay anyway
+    # round trip probe (protocol query_battery) every this many seconds, adapts the coalesce tick:
+    # poor links (high rtt or loss) get fewer larger packets up to max_coalesce, good ones full rate
+    probe: float = None
+    max_coalesce: float = 0.05 # seconds
 
     def __post_init__(self):
         self.name_to_address: dict[str, Any] = {}
+        self.pending: dict[Any, float] = {} # address -> latest value, when coalescing
+        self.last_sent: dict[Any, tuple[bytes, float]] = {} # address -> (data, timestamp)
+        self.ingest_at: dict[Any, float] = {} # address -> timestamp of the latest update not sent yet
+        self.scheduler: Scheduler = None # set by the Manager
+        self.online = True # False when its connection failed, nothing is sent then
+        self.tick = self.coalesce # effective coalesce, adapted to the link
+        self.rtt: float = None # smoothed, seconds
+        self.loss = 0. # smoothed ratio of unanswered probes
+        self.battery: int = None # latest reported level
+        self.probe_at: float = None # when the outstanding probe was sent
+        self.limiter: Limiter = None
+        self.set_limit()
+        self.levels = None # every actuator level, frame protocols only
+        self.set_frame()
+        self.bind_metrics(Registry())
         for address, actuator in self.address_to_actuator.items():
             self.add_actuator(address, actuator)
 
@@ -243,18 +945,341 @@ class Controller:
     def resolve(self, address: Any) -> Actuator:
         return self.address_to_actuator.get(address)
 
-    def info(self) -> dict: pass # TODO
+    def bind_metrics(self, metrics: Registry) -> None:
+        name = self.name
+        self.sent = metrics.counter('actuations_sent_total', "Commands sent to devices", controller=name)
+        self.suppressed = metrics.counter('actuations_suppressed_total', "Unchanged commands not sent", controller=name)
+        self.bytes_sent = metrics.counter('bytes_sent_total', "Bytes sent to devices", controller=name)
+        self.receive_errors = metrics.counter('receive_errors_total', "Errors receiving from devices", controller=name)
+        self.latency = metrics.histogram('ingest_to_send_seconds', "Delay from OSC update to command sent", controller=name)
+        def outbox(key):
+            return lambda: (o := getattr(self.connection, 'outbox', None)) and o.counters[key] or 0
+        metrics.counter_func('outbox_overwritten_total', outbox('overwritten'), "Pending commands replaced by newer ones", controller=name)
+        metrics.counter_func('outbox_dropped_total', outbox('dropped'), "Pending commands dropped, buffer full", controller=name)
+        self.rtt_histogram = metrics.histogram('device_rtt_seconds', "Probe round trip time", controller=name)
+        self.probes_lost = metrics.counter('probes_lost_total', "Probes without reply", controller=name)
+        metrics.gauge_func('coalesce_seconds', lambda: self.tick or 0, "Effective coalesce tick", controller=name)
+        def limiter(key):
+            return lambda: self.limiter and self.limiter.counters[key] or 0
+        metrics.counter_func('actuators_preempted_total', limiter('preempted'), "Running actuators stopped for higher priority ones", controller=name)
+        metrics.counter_func('actuators_restored_total', limiter('restored'), "Preempted actuators running again", controller=name)
+        metrics.counter_func('actuators_denied_total', limiter('denied'), "Updates not sent, over max_concurrent", controller=name)
+        metrics.gauge_func('actuators_active', lambda: len(self.limiter.active) if self.limiter else 0,
+                           "Actuators allowed to run under max_concurrent", controller=name)
+        if self.on_battery:
+            metrics.gauge_func('device_battery', lambda: self.battery or 0, "Battery level reported by the device", controller=name)
+
+    def info(self) -> dict:
+        return D(name=self.name, online=self.online, rtt=self.rtt, loss=self.loss,
+                 battery=self.battery, coalesce=self.tick)
+
+    def start_probe(self) -> None:
+        if self.probe and self.protocol.query_battery() != None:
+            self.scheduler.schedule(('probe', self.name), self.scheduler.clock() + self.probe, self.send_probe)
+
+    # one probe in flight at a time: no reply until the next one means lost
+    async def send_probe(self) -> None:
+        now = self.scheduler.clock()
+        self.scheduler.schedule(('probe', self.name), now + self.probe, self.send_probe)
+        if self.probe_at != None:
+            self.probes_lost.inc()
+            self.loss += PROBE_SMOOTHING * (1 - self.loss)
+            self.adapt()
+        if not self.online:
+            return
+        self.probe_at = now
+        await self.connection.send(self.protocol.query_battery())
+
+    # message parsed from the device
+    def on_incoming(self, message: dict) -> None:
+        match message.get('type'):
+            case 'battery_value':
+                self.battery = message['value']
+                if self.probe_at == None:
+                    return # late or unsolicited
+                rtt = self.scheduler.clock() - self.probe_at
+                self.probe_at = None
+                self.rtt_histogram.observe(rtt)
+                self.rtt = rtt if self.rtt == None else self.rtt + PROBE_SMOOTHING * (rtt - self.rtt)
+                self.loss -= PROBE_SMOOTHING * self.loss
+                self.adapt()
+            case _:
+                log_connection.info("%s received %s", self.name, message)
+
+    def adapt(self) -> None:
+        if (self.rtt or 0) <= GOOD_RTT and self.loss < 0.01:
+            tick = self.coalesce # good link or no measure yet
+        else:
+            # roughly one packet per round trip, less with loss, by milliseconds
+            tick = min(self.max_coalesce, max(self.coalesce or 0, (self.rtt or GOOD_RTT) / 2) * (1 + 4 * self.loss))
+            tick = round(tick, 3) or self.coalesce
+        if tick != self.tick:
+            # only switching from/to the configured rate is worth an info
+            level = logging.DEBUG if self.coalesce not in (tick, self.tick) else logging.INFO
+            log_controller.log(level, "%s coalesce %s -> %s (rtt=%s loss=%.2f)", self.name, self.tick, tick,
+                               self.rtt and f"{self.rtt*1000:.1f}ms", self.loss)
+            self.tick = tick
 
     async def actuate(self, address: Any, value: float):
-        log(f"Controller.actuate {address=} {value=}")
+        log_controller.debug("Controller.actuate address=%r value=%r", address, value)
 
         actuator = self.address_to_actuator.get(address)
         if actuator == None:
             raise Exception(f"Actuator {address=} not found")
 
-        value = actuator.map(value)
-        data = self.protocol.actuation(address, value)
-        await self.connection.send(data)
+        await self.actuate_mapped(address, actuator.map(value), value)
+
+    def set_limit(self) -> None:
+        if not self.max_concurrent:
+            self.limiter = None
+        elif self.limiter:
+            # reconfigured, applies from the next request
+            self.limiter.max_concurrent, self.limiter.priority = self.max_concurrent, self.priority
+        else:
+            self.limiter = Limiter(self.max_concurrent, self.priority)
+
+    def set_frame(self) -> None:
+        n = self.protocol.frame_size()
+        if n == None:
+            self.levels = None
+            return
+        for address in self.address_to_actuator:
+            if not isinstance(address, int) or not 0 <= address < n:
+                raise Exception(f"Controller {self.name} address {address!r} out of the {n} levels frame")
+        if self.levels is None or len(self.levels) != n: # kept across a reload otherwise
+            self.levels = np.zeros(n) if np is not None else [0.] * n
+
+    # value already went through Actuator.map, intensity is the one before (see Limiter)
+    async def actuate_mapped(self, address: Any, value: float, intensity: float = None):
+        if self.limiter:
+            for address, value in self.limiter.request(address, value, self.scheduler.clock(), intensity):
+                await self.output(address, value)
+            return
+        await self.output(address, value)
+
+    async def output(self, address: Any, value: float):
+        if self.levels is not None:
+            # one frame for all updates of the tick, or of this loop iteration
+            self.levels[address] = value
+            key = ('flush', self.name)
+            if not self.scheduler.pending(key):
+                self.scheduler.schedule(key, self.scheduler.clock() + (self.tick or 0), self.flush_frame)
+            return
+
+        if not self.tick:
+            data = self.protocol.actuation(address, value)
+            now = self.scheduler.clock()
+            if self.changed(address, data, now) and await self.send(data, address):
+                self.remember(address, data, now)
+            return
+
+        self.pending[address] = value # latest value wins within a tick
+        key = ('flush', self.name)
+        if not self.scheduler.pending(key):
+            self.scheduler.schedule(key, self.scheduler.clock() + self.tick, self.flush)
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        now = self.scheduler.clock()
+        changed = {}
+        for address, value in pending.items():
+            data = self.protocol.actuation(address, value)
+            if self.changed(address, data, now):
+                changed[address] = (value, data)
+
+        if len(changed) > 1 and (data := self.protocol.actuations(
+                { address: value for address, (value, _) in changed.items() })) != None:
+            if await self.send(data):
+                for address, (_, data) in changed.items():
+                    self.remember(address, data, now)
+                    self.observe_latency(address)
+            return
+
+        # single update or protocol without batch support
+        for address, (_, data) in changed.items():
+            if await self.send(data, address):
+                self.remember(address, data, now)
+
+    # sent only when its encoding changed (or for keepalive), latest frame wins under load
+    async def flush_frame(self):
+        data = self.protocol.frame(self.levels)
+        now = self.scheduler.clock()
+        if not self.changed('frame', data, now):
+            self.ingest_at.clear()
+            return
+        if await self.send(data, 'frame'):
+            self.remember('frame', data, now)
+        for address in list(self.ingest_at):
+            self.observe_latency(address)
+
+    def changed(self, address: Any, data: bytes, now: float) -> bool:
+        if not self.dedup:
+            return True
+        last = self.last_sent.get(address)
+        if last != None and last[0] == data and now - last[1] < self.keepalive:
+            self.suppressed.inc()
+            self.ingest_at.pop(address, None)
+            return False
+        return True
+
+    # once handed to the connection, forgotten if its outbox drops it
+    def remember(self, address: Any, data: bytes, now: float) -> None:
+        if self.dedup:
+            self.last_sent[address] = (data, now)
+
+    # the outbox of the connection reports what's actually written or dropped
+    def bind_outbox(self) -> None:
+        if (outbox := getattr(self.connection, 'outbox', None)) != None:
+            outbox.on_write, outbox.on_drop = self.written, self.dropped
+
+    def written(self, data: bytes) -> None:
+        self.sent.inc()
+        self.bytes_sent.inc(len(data))
+
+    def dropped(self, address: Any) -> None:
+        if address == None:
+            self.last_sent.clear() # a batch, its addresses aren't known anymore
+        else:
+            self.last_sent.pop(address, None)
+
+    # returns whether it was handed to the connection
+    async def send(self, data: bytes, address: Any = None) -> bool:
+        if not self.online:
+            return False
+        if address != None:
+            self.observe_latency(address)
+        if getattr(self.connection, 'outbox', None) == None:
+            self.written(data) # no flow control, written right away
+        await self.connection.send(data, address)
+        return True
+
+    def observe_latency(self, address: Any) -> None:
+        if (at := self.ingest_at.pop(address, None)) != None:
+            self.latency.observe(self.scheduler.clock() - at)
+
+
+# contact receiver spread over nearby physical actuators, see VirtualController
+@dataclass(slots=True)
+class VirtualActuator(Actuator):
+    weights: dict[str, float] = None # physical actuator name -> weight, or Actuator.position
+    nearest: int = None # by inverse distance, default: VirtualController.nearest
+
+
+# virtual actuators routed like physical ones: behaviors drive them as usual, their
+# intensities are spread onto physical actuators (of any controller) through a sparse
+# weights matrix compiled at load time, one product per tick for all of them
+@dataclass
+class VirtualController:
+    address_to_actuator: dict[Any, VirtualActuator]
+    name: str = 'virtual'
+    tick: float = 0.01 # seconds, batching period
+    nearest: int = 3 # physical actuators a positioned virtual one is spread over
+
+    def __post_init__(self):
+        if np is None:
+            raise Exception("Virtual actuators require numpy")
+        self.ingest_at: dict[Any, float] = {}
+        self.scheduler: Scheduler = None # set by the Manager
+        self.online = True
+        self.index = { address: i for i, address in enumerate(self.address_to_actuator) }
+        self.values = np.zeros(len(self.index)) # virtual intensities, already mapped
+        self.targets: list[tuple[Controller, Any]] = [] # physical (controller, address)
+
+    # weights matrix as coordinates: rows (virtual), cols (physical), w
+    def compile(self, controllers: list[Controller]) -> None:
+        physical = { a.name: (c, address, a) for c in controllers for address, a in c.address_to_actuator.items() }
+        names = list(physical)
+        col = { name: i for i, name in enumerate(names) }
+        positioned = [ name for name in names if physical[name][2].position ]
+        rows, cols, w = [], [], []
+        for address, v in self.address_to_actuator.items():
+            if v.weights:
+                weights = v.weights
+            elif v.position:
+                weights = self.spread(v, positioned, physical)
+            else:
+                raise Exception(f"Virtual actuator {v.name} needs weights or a position")
+            for name, weight in weights.items():
+                if name not in col:
+                    raise Exception(f"Virtual actuator {v.name} unknown physical actuator {name}")
+                rows.append(self.index[address])
+                cols.append(col[name])
+                w.append(weight)
+        self.rows, self.cols, self.w = np.array(rows, dtype=int), np.array(cols, dtype=int), np.array(w, dtype=float)
+        self.targets = [ physical[name][:2] for name in names ]
+        self.last = np.zeros(len(names)) # physical intensities sent
+
+    # inverse distance weights of the nearest positioned physical actuators, sum to 1
+    def spread(self, v: VirtualActuator, positioned: list[str], physical: dict) -> dict[str, float]:
+        if not positioned:
+            raise Exception(f"Virtual actuator {v.name} has a position but no physical actuator has one")
+        d = [ (sqrt(sum((p - q) ** 2 for p, q in zip(v.position, physical[name][2].position))), name)
+              for name in positioned ]
+        d = sorted(d)[:v.nearest or self.nearest]
+        if d[0][0] == 0:
+            return { d[0][1]: 1. }
+        inverse = { name: 1 / dist for dist, name in d }
+        total = sum(inverse.values())
+        return { name: x / total for name, x in inverse.items() }
+
+    # after a reload, once compiled: virtual actuators still there keep their intensity and
+    # physical ones start from what was sent, the next tick stops those not driven anymore
+    def inherit(self, old: 'VirtualController') -> None:
+        self.scheduler.cancel(('tick', id(old)))
+        index = { a.name: self.index[address] for address, a in self.address_to_actuator.items() }
+        for address, a in old.address_to_actuator.items():
+            if (i := index.get(a.name)) != None:
+                self.values[i] = old.values[old.index[address]]
+        sent = { (c.name, address): v for (c, address), v in zip(old.targets, old.last.tolist()) }
+        for i, (c, address) in enumerate(self.targets):
+            self.last[i] = sent.get((c.name, address), 0.)
+        if self.values.any() or self.last.any():
+            self.scheduler.schedule(('tick', id(self)), self.scheduler.clock() + self.tick, self.flush)
+
+    # virtual actuators removed: stops the physical ones they were driving
+    async def release(self, controllers: list[Controller]) -> None:
+        self.scheduler.cancel(('tick', id(self)))
+        for (c, address), value in zip(self.targets, self.last.tolist()):
+            if value and c in controllers and c.online and c.resolve(address):
+                await c.actuate(address, 0)
+
+    def resolve(self, address: Any) -> VirtualActuator:
+        return self.address_to_actuator.get(address)
+
+    async def actuate(self, address: Any, value: float):
+        await self.actuate_mapped(address, self.address_to_actuator[address].map(value))
+
+    # value already went through VirtualActuator.map, applied on the next tick
+    async def actuate_mapped(self, address: Any, value: float, intensity: float = None):
+        self.values[self.index[address]] = value
+        key = ('tick', id(self))
+        if not self.scheduler.pending(key):
+            self.scheduler.schedule(key, self.scheduler.clock() + self.tick, self.flush)
+
+    # physical = W @ virtual, only changed physical actuators are handed to their controller
+    async def flush(self):
+        physical = np.minimum(np.bincount(self.cols, weights=self.w * self.values[self.rows],
+                                          minlength=len(self.targets)), 1)
+        changed = np.flatnonzero(physical != self.last)
+        self.last = physical
+        for i, value in zip(changed.tolist(), physical[changed].tolist()):
+            controller, address = self.targets[i]
+            await controller.actuate(address, value)
+
+
+# compiled topology: one per actuator with a dense id, built once by the Router,
+# everything an update needs is one path lookup away
+@dataclass(slots=True, eq=False)
+class Route:
+    id: int
+    path: str # full OSC path
+    controller: 'Controller'
+    address: Any
+    actuator: Actuator
+    state: Any = None # set by the behavior
+
+    async def actuate(self, value: float) -> None:
+        await self.controller.actuate_mapped(self.address, self.actuator.map(value), value)
 
 
 @dataclass
@@ -263,139 +1288,191 @@ class Router():
 
     def __post_init__(self):
         self.name_to_controller = {}
+        self.paths: dict[str, Route] = {} # full path -> route
+        self.by_id: list[Route] = [] # id -> route
+        self.bind_metrics(Registry())
 
-    def add_controller(self, controller: Controller) -> None:
-        for a in controller.actuators():
+    def bind_metrics(self, metrics: Registry) -> None:
+        self.unresolved = metrics.counter('osc_unresolved_total', UNRESOLVED_HELP, source='router')
+
+    # old: (controller name, address, actuator name) -> route to reuse, see rebuild
+    def add_controller(self, controller: Controller, old: dict = None) -> None:
+        for address, a in controller.address_to_actuator.items():
             if (c := self.name_to_controller.get(a.name)) and c != controller:
                 raise Exception(f"Conflict {a.name} already registered by {c.name}")
             self.name_to_controller[a.name] = controller
+            route = old and old.pop((controller.name, address, a.name), None)
+            if route:
+                route.id, route.path = len(self.by_id), self.prefix + a.name
+                route.controller, route.actuator = controller, a
+            else:
+                route = Route(len(self.by_id), self.prefix + a.name, controller, address, a)
+            self.by_id.append(route)
+            self.paths[route.path] = route
+
+    # routes of actuators still mapped to the same controller and address are kept
+    # (with their behavior state), returns the removed ones
+    def rebuild(self, controllers: list[Controller]) -> list[Route]:
+        old = { (r.controller.name, r.address, r.actuator.name): r for r in self.by_id }
+        self.name_to_controller, self.paths, self.by_id = {}, {}, []
+        for c in controllers:
+            self.add_controller(c, old)
+        return list(old.values())
 
     def controllers(self) -> list[Controller]:
         return list(self.name_to_controller.values())
 
-    def resolve_name(self, name: str) -> (Controller, Any):
-        controller = self.name_to_controller.get(name)
-        if controller == None:
-            return None
-        address = controller.actuator_address(name)
-        return (controller, address)
+    def resolve_name(self, name: str) -> Route:
+        return self.paths.get(self.prefix + name)
 
-    def resolve_path(self, path: str) -> (Controller, Any):
-        if not path.startswith(self.prefix):
-            return None
-        name = path[len(self.prefix):] # remove prefix
-        return self.resolve_name(name)
+    def resolve_path(self, path: str) -> Route:
+        route = self.paths.get(path)
+        if route == None:
+            self.unresolved.inc()
+        return route
 
+    # precomputed full path (bytes) -> route
+    def routes(self) -> dict[bytes, Route]:
+        return { path.encode(): route for path, route in self.paths.items() }
 
-@dataclass
+
+# per actuator state, slotted: no instance dict
+@dataclass(slots=True)
 class BehaviorState:
     timeout_at: float = 0 # absolute timestamp
-    timeout_task: asyncio.Task = None
 
 @dataclass
 class Behavior:
     timeout: float = 0.25 # turn off after no update
-    # must be defined by subclasses
-    #states: (Controller, address) -> BehaviorState
+    # set by the Manager
+    #scheduler: Scheduler
 
     async def start(self) -> None: pass
     async def stop(self) -> None: pass
-    async def on_update(self, Controller: Controller, address: Any, distance: float) -> None: pass
-
-    def get_state(self, controller: Controller, address: Any) -> BehaviorState:
-        return self.states[(controller.name, address)]
-
-    async def on_timeout(self, state: BehaviorState, controller: Controller, address: Any, actuator: Actuator):
-        log(f'{controller.name}/{actuator.name} on_timeout') # debug
-        await controller.actuate(address, 0) # TODO: should register the stop?
-        state.timeout_task = None
-        state.timeout_at = None
-
-    async def ensure_timeout(self, now: float, state: BehaviorState, controller: Controller, address: Any, actuator: Actuator):
-        loop = asyncio.get_event_loop()
-        if state.timeout_task:
-            state.timeout_task.cancel() # reschedule
-        f = self.on_timeout(state, controller, address, actuator)
-        state.timeout_task = loop.create_task(delayed_async(self.timeout, f))
-        state.timeout_at = now + self.timeout
+    # called with all routes (indexed by id), sets the state of new ones
+    # called again after a reload: routes kept have their state already
+    def compile(self, routes: list[Route]) -> None:
+        for route in routes:
+            if route.state == None:
+                route.state = self.new_state(route)
+    # route removed by a reload
+    def forget(self, route: Route) -> None:
+        self.scheduler.cancel(route)
+    def new_state(self, route: Route) -> BehaviorState:
+        return BehaviorState()
+    # actuator not idle: its timeout is pending
+    def running(self, route: Route) -> bool:
+        return bool(route.state and route.state.timeout_at)
+    # once stopped, before the behavior is replaced: running actuators are turned off
+    async def release(self, routes: list[Route]) -> None:
+        for route in routes:
+            if self.running(route):
+                await route.controller.actuate_mapped(route.address, 0)
+    # at: arrival timestamp of the update, now when unknown
+    async def on_update(self, route: Route, distance: float, at: float = None) -> None: pass
+
+    def bind_metrics(self, metrics: Registry) -> None:
+        self.throttled = metrics.counter('throttled_samples_total', "Samples received while throttled")
+
+    async def on_timeout(self, route: Route):
+        log_behavior.debug("%s on_timeout", route.path)
+        await route.actuate(0) # TODO: should register the stop?
+        route.state.timeout_at = None
+
+    # bound once: every timer of the actuators holds the same one
+    @cached_property
+    def timeout_callback(self) -> Awaitable:
+        return self.on_timeout
+
+    async def ensure_timeout(self, now: float, route: Route):
+        route.state.timeout_at = now + self.timeout
+        # reschedule, supersedes the previous deadline
+        # keyed by the route itself: no key tuple per actuator
+        self.scheduler.schedule(route, route.state.timeout_at, self.timeout_callback, route)
 
 
 @dataclass
 class ProximityBased(Behavior):
     def __post_init__(self):
-        self.states = defaultdict(BehaviorState)
+        self.bind_metrics(Registry())
 
-    async def on_update(self, controller: Controller, address: Any, distance: float) -> None:
-        log(f"ProximityBased.on_update {controller.name}#{address} -> {distance=}")
-        now = time()
-        state = self.get_state(controller, address)
-        actuator = controller.resolve(address)
+    async def on_update(self, route: Route, distance: float, at: float = None) -> None:
+        log_behavior.debug("ProximityBased.on_update %s -> distance=%r", route.path, distance)
+        now = self.scheduler.clock() if at == None else at
 
         intensity = 1 - distance # yeah like proximity
-        await controller.actuate(address, intensity)
-        await self.ensure_timeout(now, state, controller, address, actuator)
+        await route.actuate(intensity)
+        await self.ensure_timeout(now, route)
         # TODO: handle throttle?
 
 
-@dataclass
+@dataclass(slots=True)
 class VelocityState(BehaviorState):
     next_at: float = 0 # absolute timestamp
     last_distance: float = 0
     last_time: float = 0
-    samples: list[float] = field(default_factory=list)
-    throttled_task: asyncio.Task = None
+    smoothing: Smoothing = None # velocity samples
 
 @dataclass
 class VelocityBased(Behavior):
     stall_time: float = 0.5 # max sample time
 
     def __post_init__(self):
-        self.states = defaultdict(VelocityState)
+        self.bind_metrics(Registry())
+
+    def new_state(self, route: Route) -> VelocityState:
+        return VelocityState(smoothing=route.actuator.new_smoothing())
+
+    def compile(self, routes: list[Route]) -> None:
+        super().compile(routes)
+        for route in routes:
+            if route.state.smoothing != (smoothing := route.actuator.new_smoothing()):
+                route.state.smoothing = smoothing # reconfigured
 
-    async def on_update(self, controller: Controller, address: Any, distance: float) -> None:
-        state = self.get_state(controller, address)
-        actuator = controller.resolve(address)
-        # TODO: can get actuator extra attributes
+    def forget(self, route: Route) -> None:
+        super().forget(route)
+        self.scheduler.cancel(('throttle', route))
 
-        now = time()
+    async def on_update(self, route: Route, distance: float, at: float = None) -> None:
+        state = route.state
+        now = self.scheduler.clock() if at == None else at # velocity over arrival times
         dt = now - state.last_time
 
         if dt > self.stall_time:
-            state.samples = []
-            log(f"{controller.name}/{actuator.name} samples stall") # debug
+            state.smoothing.reset()
+            log_behavior.debug("%s samples stall", route.path)
         else:
             ddist = abs(state.last_distance - distance)
-            v = clamp(ddist / dt / actuator.collider_scaler, 0, 1) # normalized 0-1
-            state.samples.append(v)
+            v = clamp(ddist / dt / route.actuator.collider_scaler, 0, 1) # normalized 0-1
+            state.smoothing.add(v)
 
         state.last_time = now
         state.last_distance = distance
 
-        await self.on_sample(now, state, controller, address, actuator)
+        await self.on_sample(now, route)
 
-    async def on_sample(self, now: float, state: VelocityState, controller: Controller, address: Any, actuator: Actuator):
-        if state.throttled_task != None:
+    async def on_sample(self, now: float, route: Route):
+        if route.state.next_at:
+            self.throttled.inc()
             return # throttled
 
-        await self.handle_samples(now, state, controller, address, actuator)
+        await self.handle_samples(now, route)
 
-    # TODO: consider doing a continuous moving average (smoother)
-    async def handle_samples(self, now: float, state: VelocityState, controller: Controller, address: Any, actuator: Actuator):
-        loop = asyncio.get_event_loop()
-
-        if len(state.samples) == 0:
+    async def handle_samples(self, now: float, route: Route):
+        state = route.state
+        if state.smoothing.count == 0:
             return # nothing to do
 
-        v_avg = sum(state.samples) / len(state.samples)
-        await controller.actuate(address, v_avg)
-        log(f'{controller.name}/{actuator.name} -> actuate {v_avg*100=:3.2f}% samples={len(state.samples)} ') # debug
-        state.samples = [] # flush data
+        v_avg = state.smoothing.value()
+        await route.actuate(v_avg)
+        log_behavior.debug("%s -> actuate %3.2f%% samples=%d", route.path, v_avg*100, state.smoothing.count)
+        state.smoothing.flush()
 
         # will actuate for a bit until timeout
-        await self.ensure_timeout(now, state, controller, address, actuator)
+        await self.ensure_timeout(now, route)
 
         throttle_time: float = None
-        if (throttle := actuator.throttle):
+        if (throttle := route.actuator.throttle):
             if (w := throttle.get('constant')):
                 throttle_time = w
             elif (w := throttle.get('random')):
@@ -404,20 +1481,390 @@ class VelocityBased(Behavior):
 
         # don't spam actuator + allows to collect more samples
         if throttle_time:
-            if state.throttled_task != None:
-                log(f"Warning {controller.name}/{actuator.name} trying to schedule throttle task but one is already set!") # TODO: debug
+            if state.next_at:
+                log_behavior.warning("%s trying to schedule throttle but one is already set!", route.path)
             else:
-                f = self.on_throttle_over(state, controller, address, actuator)
-                state.throttled_task = loop.create_task(delayed_async(throttle_time, f))
                 state.next_at = now + throttle_time
-                log(f"{controller.name}/{actuator.name} schedule throttle {throttle_time=:.1f}") # TODO: debug
+                self.scheduler.schedule(('throttle', route), state.next_at, self.on_throttle_over, route)
+                log_behavior.debug("%s schedule throttle throttle_time=%.1f", route.path, throttle_time)
 
-    async def on_throttle_over(self, state: VelocityState, controller: Controller, address: Any, actuator: Actuator):
-        log(f'{controller.name}/{actuator.name} on_throttle_over ({len(state.samples)} samples)') # debug
-        now = time()
-        state.throttled_task = None
-        state.next_at = None
-        await self.handle_samples(now, state, controller, address, actuator)
+    async def on_throttle_over(self, route: Route):
+        log_behavior.debug("%s on_throttle_over (%d samples)", route.path, route.state.smoothing.count)
+        now = self.scheduler.clock()
+        route.state.next_at = None
+        await self.handle_samples(now, route)
+
+
+# same as VelocityBased but the state of all actuators lives in arrays indexed by
+# a dense id: updates are only recorded, then processed together every tick,
+# the loop is parked while nothing moves and woken up by the next update
+@dataclass
+class VelocityBasedNumpy(Behavior):
+    stall_time: float = 0.5 # max sample time
+    tick: float = 0.01 # batch processing period
+
+    def __post_init__(self):
+        if np is None:
+            raise Exception("VelocityBasedNumpy requires numpy")
+        self.routes: list[Route] = []
+        self.targets: list[tuple] = [] # route id -> (controller, address, actuator)
+        self.rng = np.random.default_rng()
+        self.ticking = False # loop scheduled
+        self.bind_metrics(Registry())
+        self.build()
+
+    # per actuator arrays carried over by a reload
+    STATE = ('distance', 'time', 'dirty', 'last_distance', 'last_time', 'next_at', 'timeout_at',
+             'v_count', 'v_sum', 'ema', 'peak', 'ring_pos', 'ring_filled')
+
+    def compile(self, routes: list[Route]) -> None:
+        previous = { id(r): i for i, r in enumerate(self.routes) }
+        kept = [ (i, previous[id(r)]) for i, r in enumerate(routes) if id(r) in previous ]
+        old = { name: getattr(self, name) for name in (*self.STATE, 'ring', 'smoothing', 'window', 'alpha', 'decay') }
+
+        self.routes = list(routes)
+        self.targets = [ (r.controller, r.address, r.actuator) for r in routes ]
+        self.build()
+        if not kept:
+            return
+        new, prev = np.array(kept).T
+        for name in self.STATE:
+            getattr(self, name)[new] = old[name][prev]
+        w = min(self.ring.shape[1], old['ring'].shape[1])
+        self.ring[new, :w] = old['ring'][prev, :w]
+        # reconfigured smoothing starts over
+        changed = ((self.smoothing[new] != old['smoothing'][prev]) | (self.window[new] != old['window'][prev])
+                   | (self.alpha[new] != old['alpha'][prev]) | (self.decay[new] != old['decay'][prev]))
+        self.reset_samples(new[changed])
+
+    def build(self):
+        n = len(self.targets)
+        actuators = [ a for _, _, a in self.targets ]
+        def column(f):
+            return np.array([ f(a) for a in actuators ], dtype=float)
+
+        # latest raw sample since last tick (latest wins)
+        self.distance = np.zeros(n)
+        self.time = np.zeros(n)
+        self.dirty = np.zeros(n, dtype=bool)
+        # processed state
+        self.last_distance = np.zeros(n)
+        self.last_time = np.zeros(n)
+        self.next_at = np.zeros(n) # throttled until, 0 when not
+        self.timeout_at = np.zeros(n) # 0 when not running
+        # actuator parameters
+        self.collider_scaler = column(lambda a: a.collider_scaler)
+        self.min_sensitivity = column(lambda a: a.min_sensitivity)
+        self.min = column(lambda a: a.min)
+        self.max = column(lambda a: a.max)
+        self.throttle_constant = column(lambda a: (a.throttle or {}).get('constant') or 0)
+        self.throttle_random = column(lambda a: (a.throttle or {}).get('random') or 0)
+        self.throttle_random[self.throttle_constant > 0] = 0 # constant has priority
+
+        # smoothing, same as Smoothing classes but for all actuators at once
+        smoothings = [ a.new_smoothing() for a in actuators ]
+        kinds = [ Average, EMA, Window, PeakHold ]
+        for a, sm in zip(actuators, smoothings):
+            if type(sm) not in kinds:
+                raise Exception(f"Actuator {a.name} smoothing {type(sm).__name__} unsupported")
+        self.smoothing = np.array([ kinds.index(type(sm)) for sm in smoothings ], dtype=int)
+        self.alpha = np.array([ getattr(sm, 'alpha', 0) for sm in smoothings ], dtype=float)
+        self.window = np.array([ getattr(sm, 'size', 1) for sm in smoothings ], dtype=int)
+        # PeakHold decay, -1 when None: peak since last actuation
+        self.decay = np.array([ -1 if (d := getattr(sm, 'decay', None)) is None else d for sm in smoothings ], dtype=float)
+        self.v_count = np.zeros(n) # samples since last actuation
+        self.v_sum = np.zeros(n) # Average and Window
+        self.ema = np.full(n, np.nan) # EMA, nan when empty
+        self.peak = np.zeros(n) # PeakHold
+        self.ring = np.zeros((n, self.window.max(initial=1))) # Window
+        self.ring_pos = np.zeros(n, dtype=int)
+        self.ring_filled = np.zeros(n, dtype=int)
+
+    async def start(self) -> None:
+        self.wake()
+
+    async def stop(self) -> None:
+        self.scheduler.cancel(('tick', id(self)))
+        self.ticking = False
+
+    def running(self, route: Route) -> bool:
+        return self.timeout_at[route.id] > 0
+
+    def wake(self) -> None:
+        if not self.ticking:
+            self.ticking = True
+            self.scheduler.schedule(('tick', id(self)), self.scheduler.clock() + self.tick, self.on_tick)
+
+    async def on_update(self, route: Route, distance: float, at: float = None) -> None:
+        i = route.id
+        self.distance[i] = distance
+        self.time[i] = self.scheduler.clock() if at == None else at
+        self.dirty[i] = True
+        if not self.ticking:
+            self.wake()
+
+    async def on_tick(self):
+        self.ticking = False
+        await self.step(self.scheduler.clock())
+        # new samples, running or throttled actuators
+        if self.dirty.any() or self.timeout_at.any() or self.next_at.any():
+            self.wake()
+
+    async def step(self, now: float):
+        # new samples -> velocity
+        d = np.flatnonzero(self.dirty)
+        if len(d):
+            self.dirty[d] = False
+            dt = self.time[d] - self.last_time[d]
+            stall = dt > self.stall_time
+            self.reset_samples(d[stall])
+            ok = d[~stall]
+            ddist = np.abs(self.last_distance[ok] - self.distance[ok])
+            v = ddist / np.maximum(dt[~stall], 1e-6) / self.collider_scaler[ok]
+            self.add_samples(ok, np.clip(v, 0, 1)) # normalized 0-1
+            self.throttled.inc(int(np.count_nonzero(self.next_at[ok] > now)))
+            self.last_time[d] = self.time[d]
+            self.last_distance[d] = self.distance[d]
+
+        # timeouts and throttles over
+        timeouts = np.flatnonzero((self.timeout_at > 0) & (self.timeout_at <= now))
+        self.timeout_at[timeouts] = 0
+        self.next_at[(self.next_at > 0) & (self.next_at <= now)] = 0
+
+        # smoothed samples of non throttled actuators
+        r = np.flatnonzero((self.v_count > 0) & (self.next_at == 0))
+        v_avg = self.flush_samples(r)
+
+        # vectorized Actuator.map
+        min_s, min_, max_ = self.min_sensitivity[r], self.min[r], self.max[r]
+        span = 1 - min_s # 0 when min_sensitivity is 1: max once reached
+        ratio = np.divide(v_avg - min_s, span, out=np.ones_like(v_avg), where=span > 0)
+        values = (max_ - min_) * ratio + min_
+        values = np.where(v_avg < min_s, 0., np.minimum(max_, np.maximum(min_, values)))
+
+        # will actuate for a bit until timeout
+        self.timeout_at[r] = now + self.timeout
+        # don't spam actuator, random is inverse proportional to intensity
+        w = self.throttle_random[r]
+        throttle_time = np.where(self.throttle_constant[r] > 0, self.throttle_constant[r],
+                                 self.rng.random(len(r)) * np.clip((1 - v_avg) * w, 0, w))
+        self.next_at[r] = np.where(throttle_time > 0, now + throttle_time, 0)
+
+        for i in timeouts:
+            if self.timeout_at[i] == 0: # not re-armed this tick
+                controller, address, _ = self.targets[i]
+                await controller.actuate(address, 0)
+        for i, value, intensity in zip(r.tolist(), values.tolist(), v_avg.tolist()):
+            controller, address, _ = self.targets[i]
+            await controller.actuate_mapped(address, value, intensity)
+
+    def add_samples(self, idx, v):
+        kind = self.smoothing[idx]
+        m = kind == 0 # Average
+        self.v_sum[idx[m]] += v[m]
+        m = kind == 1 # EMA
+        i, prev = idx[m], self.ema[idx[m]]
+        self.ema[i] = np.where(np.isnan(prev), v[m], prev + self.alpha[i] * (v[m] - prev))
+        m = kind == 2 # Window
+        i, pos = idx[m], self.ring_pos[idx[m]]
+        full = self.ring_filled[i] == self.window[i]
+        self.v_sum[i] += v[m] - np.where(full, self.ring[i, pos], 0)
+        self.ring[i, pos] = v[m]
+        self.ring_pos[i] = (pos + 1) % self.window[i]
+        self.ring_filled[i] = np.minimum(self.ring_filled[i] + 1, self.window[i])
+        m = kind == 3 # PeakHold
+        i = idx[m]
+        self.peak[i] = np.maximum(v[m], self.peak[i] * np.where(self.decay[i] < 0, 1, self.decay[i]))
+        self.v_count[idx] += 1
+
+    def flush_samples(self, idx):
+        kind = self.smoothing[idx]
+        values = np.select(
+                [ kind == 0, kind == 1, kind == 2 ],
+                [ self.v_sum[idx] / np.maximum(self.v_count[idx], 1),
+                  self.ema[idx],
+                  self.v_sum[idx] / np.maximum(self.ring_filled[idx], 1) ],
+                self.peak[idx])
+        self.v_count[idx] = 0
+        self.v_sum[idx[kind == 0]] = 0
+        self.peak[idx[(kind == 3) & (self.decay[idx] < 0)]] = 0 # no decay: peak since last
+        return values
+
+    def reset_samples(self, idx):
+        self.v_count[idx] = 0
+        self.v_sum[idx] = 0
+        self.ema[idx] = np.nan
+        self.peak[idx] = 0
+        self.ring[idx] = 0
+        self.ring_pos[idx] = 0
+        self.ring_filled[idx] = 0
+
+
+# haptic effect declared in the config, rendered once into a table of levels (0-1)
+# sampled at the playback rate, eg: { shape: sine, frequency: 8, duration: 0.5 }
+@dataclass
+class Effect:
+    name: str
+    shape: str = 'pulse' # pulse, sine, square or samples
+    duration: float = 0.05 # seconds
+    level: float = 1.0
+    frequency: float = 10 # Hz, sine and square
+    duty: float = 0.5 # square, part of the period on
+    attack: float = 0 # seconds, linear fade in
+    release: float = 0 # seconds, linear fade out
+    samples: list[float] = None # levels spread over duration
+    loop: bool = False # repeats while the contact lasts
+
+    SHAPES = ('pulse', 'sine', 'square', 'samples')
+
+    def __post_init__(self):
+        if self.shape not in self.SHAPES:
+            raise Exception(f"Effect {self.name} unknown shape {self.shape}, expected one of {self.SHAPES}")
+        if self.shape == 'samples' and not self.samples:
+            raise Exception(f"Effect {self.name} samples shape without samples")
+
+    def level_at(self, t: float) -> float:
+        if self.shape == 'sine':
+            v = 0.5 + 0.5 * sin(2 * pi * self.frequency * t)
+        elif self.shape == 'square':
+            v = 1. if (t * self.frequency) % 1 < self.duty else 0.
+        elif self.shape == 'samples':
+            v = self.samples[min(int(t / self.duration * len(self.samples)), len(self.samples) - 1)]
+        else: # pulse
+            v = 1.
+        if self.attack:
+            v *= min(1, t / self.attack)
+        if self.release:
+            v *= min(1, (self.duration - t) / self.release)
+        return clamp(v * self.level, 0, 1)
+
+    def render(self, rate: float) -> list[float]:
+        n = max(1, round(self.duration * rate))
+        return [ self.level_at(i / rate) for i in range(n) ]
+
+
+@dataclass(slots=True)
+class WaveformState(BehaviorState):
+    table: list[float] = None # effect of the actuator, levels 0-1
+    loop: bool = False
+    touching: bool = False
+    voices: list[list] = field(default_factory=list) # [table, position, loop] playing
+
+
+# plays an effect on each new contact instead of following the distance: effects are
+# rendered once into tables so that the playback loop only indexes them at a fixed rate;
+# overlapping effects of an actuator are mixed (0-1 levels) then go through Actuator.map
+@dataclass
+class WaveformBased(Behavior):
+    effects: dict = field(default_factory=dict) # name -> Effect parameters
+    effect: str = None # default for actuators without one
+    rate: float = 100 # playback Hz
+    mix: str = 'max' # or sum, of overlapping effects
+
+    def __post_init__(self):
+        if self.mix not in ('max', 'sum'):
+            raise Exception(f"WaveformBased unknown mix {self.mix}, expected max or sum")
+        self.active: dict[Route, None] = {} # routes with voices, in trigger order
+        self.next_tick: float = None # playback loop running when set
+        self.bind_metrics(Registry())
+        self.render() # validate early
+
+    def bind_metrics(self, metrics: Registry) -> None:
+        super().bind_metrics(metrics)
+        self.triggered = metrics.counter('effects_triggered_total', "Effects started by a contact")
+
+    def render(self) -> dict[str, tuple[list[float], bool]]:
+        effects = { name: Effect(name, **params) for name, params in self.effects.items() }
+        return { name: (e.render(self.rate), e.loop) for name, e in effects.items() }
+
+    def new_state(self, route: Route) -> WaveformState:
+        return WaveformState()
+
+    # also after a reload: tables follow the effects and actuators config,
+    # voices playing keep their table until they end
+    def compile(self, routes: list[Route]) -> None:
+        super().compile(routes)
+        rendered = self.render() # actuators playing the same effect share its table
+        for route in routes:
+            a = route.actuator
+            name = a.effect or self.effect
+            if name not in rendered:
+                raise Exception(f"Actuator {a.name} effect {name} not found in {list(rendered)}")
+            route.state.table, route.state.loop = rendered[name]
+
+    def forget(self, route: Route) -> None:
+        super().forget(route)
+        self.active.pop(route, None)
+
+    def running(self, route: Route) -> bool:
+        return bool(route.state and (route.state.voices or route.state.timeout_at))
+
+    async def stop(self) -> None:
+        self.scheduler.cancel(('tick', id(self)))
+        self.next_tick = None
+        self.active.clear()
+
+    async def on_update(self, route: Route, distance: float, at: float = None) -> None:
+        now = self.scheduler.clock() if at == None else at
+        state = route.state
+        if distance >= 1:
+            self.release(route)
+            return
+        if not state.touching: # new contact
+            log_behavior.debug("%s trigger effect", route.path)
+            state.touching = True
+            state.voices.append([ state.table, 0, state.loop ])
+            self.triggered.inc()
+            self.active[route] = None
+            if self.next_tick == None:
+                self.next_tick = self.scheduler.clock() + 1 / self.rate
+                self.scheduler.schedule(('tick', id(self)), self.next_tick, self.on_tick)
+        await self.ensure_timeout(now, route)
+
+    async def on_timeout(self, route: Route):
+        log_behavior.debug("%s on_timeout", route.path)
+        route.state.timeout_at = None
+        self.release(route)
+
+    # contact over: looping effects stop, others play until their end
+    def release(self, route: Route) -> None:
+        state = route.state
+        state.touching = False
+        if any(v[2] for v in state.voices):
+            state.voices = [ v for v in state.voices if not v[2] ]
+
+    async def on_tick(self):
+        # fixed rate, catches up on the grid unless a whole period late
+        now = self.scheduler.clock()
+        self.next_tick = max(self.next_tick + 1 / self.rate, now)
+        await self.step()
+        if self.active:
+            self.scheduler.schedule(('tick', id(self)), self.next_tick, self.on_tick)
+        else:
+            self.next_tick = None
+
+    async def step(self):
+        add = max if self.mix == 'max' else lambda a, b: a + b
+        for route in list(self.active):
+            voices = route.state.voices
+            if not voices: # all ended on the previous tick
+                del self.active[route]
+                await route.controller.actuate_mapped(route.address, 0.)
+                continue
+            value = 0.
+            for v in voices:
+                table, i, loop = v
+                value = add(value, table[i])
+                i += 1
+                if i == len(table):
+                    if not loop:
+                        v[1] = -1 # ended
+                        continue
+                    i = 0
+                v[1] = i
+            if any(v[1] < 0 for v in voices):
+                voices[:] = [ v for v in voices if v[1] >= 0 ]
+            await route.actuate(min(value, 1.))
 
 
 @dataclass
@@ -426,26 +1873,73 @@ class Manager:
     router: Router
     behavior: Behavior
     controllers: list[Controller]
+    metrics: Registry = field(default_factory=Registry)
+    shed_after: float = None # seconds, skip updates this late if a newer one is queued
+    virtual: VirtualController = None # routed after the physical actuators
 
     def __post_init__(self):
+        self.recorder = None # records incoming updates when set
+        self.run = False
+        self.scheduler = Scheduler() # shared by all timers
+        self.behavior.scheduler = self.scheduler
+        self.game.metrics = self.metrics
+        self.game.clock = self.scheduler.clock
+        self.router.bind_metrics(self.metrics)
+        self.behavior.bind_metrics(self.metrics)
+        self.messages = self.metrics.counter('osc_messages_total', "OSC messages received")
+        self.shed = self.metrics.counter('updates_shed_total', "Late updates skipped in favor of newer ones")
+        self.lag_monitor = LoopLagMonitor(self.metrics)
         for c in self.controllers:
+            c.scheduler = self.scheduler
+            c.bind_metrics(self.metrics)
             self.router.add_controller(c)
+        if self.virtual:
+            self.virtual.scheduler = self.scheduler
+            self.virtual.compile(self.controllers)
+            self.router.add_controller(self.virtual)
+        self.behavior.compile(self.router.by_id)
+
+    async def connect(self, loop, c: Controller) -> None:
+        async def on_receive(data):
+            try:
+                message = c.protocol.parse_incoming(data)
+                log_connection.debug("on_receive: data=%r %s", data, message)
+                c.on_incoming(message)
+            except Exception as e:
+                c.receive_errors.inc()
+                log_connection.warning("%s on_receive: data=%r %s", c.name, data, e)
+        async def on_error(data):
+            c.receive_errors.inc()
+            log_connection.error("on_error: data=%r", data) # TODO:
+
+        start = perf_counter()
+        try:
+            await asyncio.wait_for(c.connection.connect(loop, on_receive, on_error), c.connection.connect_timeout)
+            c.bind_outbox()
+            c.online = True
+            log_connection.info("%s connected in %.3fs", c.name, perf_counter() - start)
+            c.start_probe()
+        except Exception as e:
+            # the others keep working without it
+            c.online = False
+            log_connection.error("%s couldn't connect after %.3fs: %s", c.name, perf_counter() - start,
+                                 e if str(e) else type(e).__name__)
 
     async def start(self) -> None:
         loop = asyncio.get_event_loop()
 
-        for c in self.controllers:
-            async def on_receive(data):
-                log(f"on_receive: {data=}", c.protocol.parse_incoming(data))
-            async def on_error(data):
-                log(f"on_error: {data=}") # TODO:
-            await c.connection.connect(loop, on_receive, on_error)
+        # concurrently, startup takes as long as the slowest controller
+        start = perf_counter()
+        await asyncio.gather(*(self.connect(loop, c) for c in self.controllers))
+        online = sum(c.online for c in self.controllers)
+        log.info("%d/%d controllers connected in %.3fs", online, len(self.controllers), perf_counter() - start)
 
+        self.lag_monitor.start()
         await self.behavior.start()
+        connected = perf_counter()
         await self.game.start()
-        self.game.listen_distance(path=self.router.prefix,
-                                  callback=self.on_update,
-                                  wildcard_prefix=True)
+        self.listen()
+        log.info("game listening in %.3fs, started in %.3fs", perf_counter() - connected, perf_counter() - start)
         self.run = True
 
         try:
@@ -454,16 +1948,153 @@ class Manager:
         except asyncio.exceptions.CancelledError:
             pass # normal shutdown
 
-    async def on_update(self, path: str, *args) -> None:
-        x = self.router.resolve_path(path)
-        if x == None:
-            log(f"Warning: received unregistered {path=} {args}")
+    def listen(self) -> None:
+        if not self.game.listen_routes(prefix=self.router.prefix,
+                                       routes=self.router.routes(),
+                                       callback=self.on_route):
+            self.game.listen_distance(path=self.router.prefix,
+                                      callback=self.on_update,
+                                      wildcard_prefix=True)
+        self.game.advertise([ r.path for r in self.router.by_id ])
+
+    # applies a new config, built as another Manager, while running: parameters are
+    # updated in place, only controllers whose protocol or connection changed are
+    # reconnected, the others keep their state and timers (no haptic gap)
+    async def reload(self, new: 'Manager') -> None:
+        start = perf_counter()
+        loop = asyncio.get_event_loop()
+        if new.game != self.game:
+            log.warning("reload: game changes need a restart, ignored")
+
+        if type(new.behavior) != type(self.behavior):
+            # states aren't compatible, start over
+            await self.behavior.stop()
+            await self.behavior.release(self.router.by_id)
+            for route in self.router.by_id:
+                self.behavior.forget(route)
+                route.state = None
+            self.behavior = new.behavior
+            self.behavior.scheduler = self.scheduler
+            self.behavior.bind_metrics(self.metrics)
+            log.info("reload: behavior replaced by %s", type(new.behavior).__name__)
+        else:
+            for f in fields(new.behavior):
+                setattr(self.behavior, f.name, getattr(new.behavior, f.name))
+
+        live = { c.name: c for c in self.controllers }
+        controllers, reconnect, removed = [], [], []
+        for n in new.controllers:
+            c = live.pop(n.name, None)
+            if c == None: # new one
+                c = n
+                c.online = False # until connected
+                c.scheduler = self.scheduler
+                c.bind_metrics(self.metrics)
+                reconnect.append(c)
+            else:
+                if n.connection != c.connection:
+                    c.online = False
+                    await self.disconnect(c)
+                    c.connection = n.connection
+                    reconnect.append(c)
+                if n.protocol != c.protocol:
+                    c.protocol = n.protocol
+                    c.last_sent.clear() # encoded differently
+                for f in fields(c):
+                    if f.name not in ('name', 'protocol', 'connection'):
+                        setattr(c, f.name, getattr(n, f.name))
+                c.adapt()
+                c.set_limit()
+                c.set_frame()
+                if not c.probe:
+                    self.scheduler.cancel(('probe', c.name))
+                elif c not in reconnect and not self.scheduler.pending(('probe', c.name)):
+                    c.start_probe()
+                c.name_to_address = {}
+                for address, actuator in c.address_to_actuator.items():
+                    c.add_actuator(address, actuator)
+            controllers.append(c)
+        for c in live.values():
+            removed.append(c)
+            self.scheduler.cancel(('probe', c.name))
+            await self.disconnect(c)
+
+        self.controllers = controllers
+        virtual, self.virtual = self.virtual, new.virtual
+        if self.virtual:
+            self.virtual.scheduler = self.scheduler
+            self.virtual.compile(controllers)
+            if virtual:
+                self.virtual.inherit(virtual)
+        prefix = self.router.prefix
+        self.router.prefix = new.router.prefix
+        stale = self.router.rebuild(controllers + ([ self.virtual ] if self.virtual else []))
+        for route in stale:
+            self.behavior.forget(route)
+        self.behavior.compile(self.router.by_id)
+
+        # the game is switched to the new routes before anything awaits:
+        # updates never reach a removed route (or a stale id of the behavior)
+        if self.run:
+            if self.router.prefix == prefix or self.game.fast_ingest:
+                self.game.listen_routes(prefix=self.router.prefix, routes=self.router.routes(), callback=self.on_route)
+                self.game.advertise([ r.path for r in self.router.by_id ])
+            else:
+                self.game.unlisten(prefix, wildcard_prefix=True)
+                self.listen()
+        for route in stale:
+            # removed virtual ones are handled by the new VirtualController tick
+            if route.controller not in removed and route.controller is not virtual and route.controller.online:
+                await route.controller.actuate_mapped(route.address, 0) # may be running
+        if virtual and not self.virtual:
+            await virtual.release(controllers)
+
+        if self.run:
+            await self.behavior.start() # restarts its loop if any
+            # new and changed controllers are offline until connected, the others keep running
+            await asyncio.gather(*(self.connect(loop, c) for c in reconnect))
+        log.info("reload: %d controllers, %d reconnected, %d removed, %d actuators in %.3fs",
+                 len(controllers), len(reconnect), len(removed), len(self.router.by_id), perf_counter() - start)
+
+    async def disconnect(self, c: Controller) -> None:
+        try:
+            await c.connection.disconnect()
+        except Exception as e:
+            log_connection.warning("%s disconnect: %s", c.name, e if str(e) else type(e).__name__)
+
+    async def on_update(self, path: str, distance: float, at: float = None) -> None:
+        self.messages.inc()
+        if at == None:
+            at = self.scheduler.clock()
+        if self.recorder:
+            self.recorder.record(at, path, distance) # shed ones included
+        if self.shed_after and self.scheduler.clock() - at > self.shed_after \
+                and self.game.newest.get(path, at) > at:
+            # the loop is late, a newer update of this actuator is queued anyway
+            self.shed.inc()
+            log_ingest.debug("shed late update path=%r at=%f", path, at)
+            return
+        route = self.router.resolve_path(path)
+        if route == None:
+            log_ingest.warning("received unregistered path=%r %r", path, distance)
             return # ignore
         else:
-            log(f"Manager.on_update {path=} {args=}")
+            log_ingest.debug("Manager.on_update path=%r distance=%r", path, distance)
+
+        route.controller.ingest_at[route.address] = at
+        await self.behavior.on_update(route, distance, at)
 
-        controller, address = x
-        await self.behavior.on_update(controller, address, *args)
+    # fast path, called synchronously by the game for each routed message
+    def on_route(self, route: Route, distance: float, at: float) -> None:
+        route.controller.ingest_at[route.address] = at
+        if self.recorder:
+            self.recorder.record(at, route.path, distance)
+        run_eager(self.behavior.on_update(route, distance, at))
 
     async def stop(self) -> None:
-        self.run = False
+        started, self.run = self.run, False
+        self.lag_monitor.stop()
+        if started:
+            await self.game.disconnect()
+        if self.recorder:
+            self.recorder.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# End-to-end latency benchmark: synthetic OSC traffic -> Manager -> simulated devices.
+# The setup of the config is replaced by synthetic controllers (ProximityBased behavior,
+# DakyProtocol, full 0-1 range) so each OSC value maps to a unique device byte: this
+# allows matching every received actuation with the OSC message that caused it.
+
+import asyncio, sys, os, json, socket, selectors, threading, yaml
+from time import perf_counter, thread_time, sleep
+from argparse import ArgumentParser
+from types import SimpleNamespace as N
+from pythonosc.osc_message_builder import OscMessageBuilder
+from config import reify_config
+D = dict
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+# device side: decode DakyProtocol commands and match them with sent values
+class DeviceSimulator:
+    def __init__(self, sent: dict):
+        self.sent = sent # (controller, address, byte) -> send time
+        self.latencies: list[float] = []
+        self.unmatched = 0
+        self.selector = selectors.DefaultSelector()
+        self.run = True
+
+    def add_udp(self, controller: str) -> int:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, N(controller=controller, read=lambda: sock.recv(4096)))
+        return sock.getsockname()[1]
+
+    def add_serial(self, controller: str) -> str:
+        master, slave = os.openpty()
+        os.set_blocking(master, False)
+        buffer = bytearray()
+        def read():
+            # split size prefixed frames
+            buffer.extend(os.read(master, 4096))
+            frames = []
+            while buffer and len(buffer) > buffer[0]:
+                frames.append(bytes(buffer[1:1+buffer[0]]))
+                del buffer[:1+buffer[0]]
+            return frames
+        self.selector.register(master, selectors.EVENT_READ, N(controller=controller, read=read, slave=slave))
+        return os.ttyname(slave)
+
+    def on_command(self, now: float, controller: str, data: bytes):
+        match data[0:1]:
+            case b'B':
+                self.on_actuate(now, controller, data[1], data[2])
+            case b'M':
+                for i in range(data[1]):
+                    self.on_actuate(now, controller, data[2+2*i], data[3+2*i])
+
+    def on_actuate(self, now: float, controller: str, address: int, value: int):
+        if value == 0:
+            return # timeout
+        t = self.sent.pop((controller, address, value), None)
+        if t == None:
+            self.unmatched += 1
+        else:
+            self.latencies.append(now - t)
+
+    def loop(self):
+        while self.run:
+            for key, _ in self.selector.select(timeout=0.1):
+                now = perf_counter()
+                data = key.data.read()
+                for frame in (data if isinstance(data, list) else [data]):
+                    self.on_command(now, key.data.controller, frame)
+
+
+# game side: stream every actuator at a fixed rate, each value encodes a unique byte
+class Sender:
+    def __init__(self, port: int, targets: list, rate: float, duration: float, sent: dict):
+        self.port = port
+        self.targets = targets # (path, controller, address)
+        self.rate = rate
+        self.duration = duration
+        self.sent = sent
+        self.count = 0
+
+    def loop(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        addr = ('127.0.0.1', self.port)
+        period = 1 / self.rate
+        start = perf_counter()
+        tick = 0
+        while (now := perf_counter()) - start < self.duration:
+            byte = 1 + tick % 255 # 0 is reserved for timeouts
+            proximity = (byte + 0.5) / 255
+            for path, controller, address in self.targets:
+                msg = OscMessageBuilder(path)
+                msg.add_arg(proximity)
+                data = msg.build().dgram
+                self.sent[(controller, address, byte)] = perf_counter()
+                sock.sendto(data, addr)
+                self.count += 1
+            tick += 1
+            if (delay := start + tick * period - perf_counter()) > 0:
+                sleep(delay)
+        sock.close()
+
+
+def build_config(args, device: DeviceSimulator) -> dict:
+    with open(args.config, 'rt') as fd:
+        config = yaml.safe_load(fd)
+    game = config['games']['VRChat']
+    game['receiving_port'] = free_port()
+    if args.fast_ingest:
+        game['fast_ingest'] = True
+
+    setup = config['setup']
+    setup['behavior'] = D(type='ProximityBased', timeout=setup.get('behavior', {}).get('timeout', 0.25))
+    # keep the shape of the configured setup unless a size is given
+    if args.actuators:
+        shapes = [ (f'bench{c}', [ f'bench{c}x{i}' for i in range(args.actuators // args.controllers) ])
+                   for c in range(args.controllers) ]
+        options = [ {} for _ in range(args.controllers) ]
+    else:
+        shapes = [ (c['name'], [ a['name'] for a in c['actuators'].values() ]) for c in setup['controllers'] ]
+        options = [ { k: c[k] for k in ('coalesce',) if k in c } for c in setup['controllers'] ]
+
+    controllers = []
+    for (name, actuators), extra in zip(shapes, options):
+        if args.serial:
+            connection = D(type='SerialUSB', product=name, serial_number=name, device=device.add_serial(name))
+        else:
+            connection = D(type='UDP', address='127.0.0.1', port=device.add_udp(name), shared=args.shared)
+        if args.coalesce != None:
+            extra['coalesce'] = args.coalesce
+        controllers.append(D(
+            name=name,
+            protocol=D(type='DakyProtocol'),
+            connection=connection,
+            dedup=False, # every value must reach the device
+            actuators={ i: D(name=a) for i, a in enumerate(actuators) },
+            **extra))
+    setup['controllers'] = controllers
+    return config
+
+
+async def bench(args) -> dict:
+    sent = {}
+    device = DeviceSimulator(sent)
+    manager = reify_config('VRChat', build_config(args, device))
+    targets = [ (manager.router.prefix + a.name, c.name, address)
+                for c in manager.controllers
+                for address, a in c.address_to_actuator.items() ]
+
+    device_thread = threading.Thread(target=device.loop, daemon=True)
+    device_thread.start()
+    run = asyncio.create_task(manager.start())
+    await asyncio.sleep(args.warmup)
+
+    sender = Sender(manager.game.receiving_port, targets, args.rate, args.duration, sent)
+    sender_thread = threading.Thread(target=sender.loop, daemon=True)
+    cpu, start = thread_time(), perf_counter()
+    sender_thread.start()
+    while sender_thread.is_alive():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(args.drain) # let the last updates through
+    cpu, elapsed = thread_time() - cpu, perf_counter() - start
+
+    device.run = False
+    await manager.stop()
+    run.cancel()
+    device_thread.join()
+
+    latencies = device.latencies
+    ms = lambda v: None if v == None else round(v * 1000, 3)
+    return D(
+            actuators=len(targets),
+            rate=args.rate,
+            transport='serial' if args.serial else 'udp shared' if args.shared else 'udp',
+            fast_ingest=args.fast_ingest,
+            messages=sender.count,
+            actuations=len(latencies),
+            dropped=sender.count - len(latencies),
+            unmatched=device.unmatched,
+            throughput=round(len(latencies) / elapsed, 1),
+            latency_ms=D(
+                p50=ms(percentile(latencies, 50)),
+                p99=ms(percentile(latencies, 99)),
+                max=ms(max(latencies, default=None)),
+                ),
+            cpu_us_per_message=round(cpu / max(1, sender.count) * 1e6, 2),
+            )
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark OSC to device latency")
+    parser.add_argument('config', type=str, nargs='?', default='config_sample.yaml')
+    parser.add_argument('--actuators', type=int, default=None, help="synthetic actuators count (default: from config)")
+    parser.add_argument('--controllers', type=int, default=1, help="split synthetic actuators between controllers")
+    parser.add_argument('--rate', type=float, default=60, help="updates per second per actuator")
+    parser.add_argument('--duration', type=float, default=5, help="seconds of traffic")
+    parser.add_argument('--warmup', type=float, default=0.5)
+    parser.add_argument('--drain', type=float, default=0.2)
+    parser.add_argument('--coalesce', type=float, default=None, help="override controllers coalesce tick")
+    parser.add_argument('--fast-ingest', action='store_true')
+    parser.add_argument('--serial', action='store_true', help="simulate devices over serial pty instead of UDP")
+    parser.add_argument('--shared', action='store_true', help="UDP controllers share one socket")
+    parser.add_argument('--json', type=str, default=None, help="write results as json to file ('-' for stdout)")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+
+    if args.json == '-':
+        print(json.dumps(result))
+        return
+    if args.json:
+        with open(args.json, 'wt') as fd:
+            json.dump(result, fd, indent=2)
+    lat = result['latency_ms']
+    print(f"{result['actuators']} actuators x {result['rate']} Hz over {result['transport']}"
+          f"{' (fast ingest)' if result['fast_ingest'] else ''}", file=sys.stderr)
+    print(f"  messages {result['messages']}, actuations {result['actuations']}, dropped {result['dropped']}, "
+          f"throughput {result['throughput']}/s", file=sys.stderr)
+    print(f"  latency p50 {lat['p50']} ms, p99 {lat['p99']} ms, max {lat['max']} ms", file=sys.stderr)
+    print(f"  cpu {result['cpu_us_per_message']} us/message", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
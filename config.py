@@ -38,9 +38,21 @@ def reify_config(game_name: str, config: dict): # WARN: config is mutated
                 **c)
         controllers.append(controller)
 
-    return base.Manager(game, router, behavior, controllers)
+    virtual = None
+    if (v := setup.get('virtual')):
+        actuators = { i: base.VirtualActuator(name=name, **(a or {}))
+                      for i, (name, a) in enumerate(v.pop('actuators').items()) }
+        virtual = base.VirtualController(address_to_actuator=actuators, **v)
 
+    return base.Manager(game, router, behavior, controllers,
+                        shed_after=setup.get('shed_after'),
+                        virtual=virtual)
 
-def load_config(game_name: str, path: str):
+
+def load_yaml(path: str) -> dict:
     with open(path, 'rt') as fd:
-        return reify_config(game_name, yaml.safe_load(fd))
+        return yaml.safe_load(fd)
+
+
+def load_config(game_name: str, path: str):
+    return reify_config(game_name, load_yaml(path))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Synthetic OSC load: streams proximity curves for every actuator of a config,
+# like avatars touching each other, to stress test ingest and behaviors.
+# Each actuator follows a curve (approach/retreat, rubbing or idle) at --rate Hz,
+# optionally with jitter, bursts (stall then everything at once), loss and bundles.
+
+import asyncio, sys, random
+from heapq import heappush, heappop
+from math import sin, pi
+from struct import pack
+from time import perf_counter
+from argparse import ArgumentParser
+from config import load_yaml
+D = dict
+
+CURVES = ('approach', 'rub', 'idle')
+
+
+def osc_string(s: bytes) -> bytes:
+    return s + b'\0' * (4 - len(s) % 4) # at least one null, 4 bytes aligned
+
+# prebuilt address + type tag, only the float changes
+def osc_prefix(path: str) -> bytes:
+    return osc_string(path.encode()) + osc_string(b',f')
+
+def osc_bundle(messages: list[bytes]) -> bytes:
+    data = bytearray(b'#bundle\0' + pack('>Q', 1)) # timetag: immediately
+    for m in messages:
+        data += pack('>i', len(m))
+        data += m
+    return bytes(data)
+
+
+# proximity over time (0: far, 1: touching), parameters drawn per actuator
+class Curve:
+    def __init__(self, kind: str, rng: random.Random):
+        self.kind = kind
+        self.phase = rng.random()
+        if kind == 'approach':
+            self.period = rng.uniform(1, 3) # seconds per approach + retreat
+            self.contact = rng.uniform(0.3, 0.7) # part of the period in contact
+            self.peak = rng.uniform(0.5, 1)
+        elif kind == 'rub':
+            self.frequency = rng.uniform(2, 5) # Hz
+            self.level = rng.uniform(0.4, 0.7)
+            self.amplitude = rng.uniform(0.1, 0.3)
+
+    def value(self, t: float) -> float:
+        if self.kind == 'approach':
+            x = (t / self.period + self.phase) % 1
+            if x > self.contact:
+                return 0.
+            return self.peak * sin(pi * x / self.contact)
+        if self.kind == 'rub':
+            v = self.level + self.amplitude * sin(2 * pi * (self.frequency * t + self.phase))
+            return min(1., max(0., v))
+        return 0. # idle
+
+
+def discover(config: dict) -> list[str]:
+    setup = config['setup']
+    prefix = setup['router']['prefix']
+    return [ prefix + a['name'] for c in setup['controllers'] for a in c['actuators'].values() ]
+
+
+def parse_mix(s: str) -> list[float]:
+    weights = D(( k, float(v) ) for k, v in (kv.split('=') for kv in s.split(',')))
+    for k in weights:
+        if k not in CURVES:
+            raise Exception(f"Unknown curve {k}, expected one of {CURVES}")
+    return [ weights.get(k, 0) for k in CURVES ]
+
+
+class LoadGenerator:
+    def __init__(self, args, paths: list[str]):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        weights = parse_mix(args.mix)
+        self.streams = [ (osc_prefix(p), Curve(self.rng.choices(CURVES, weights)[0], self.rng)) for p in paths ]
+        self.queue: list = [] # (send at, seq, message) delayed by jitter or bursts
+        self.seq = 0
+        self.hold_until = 0. # burst: messages wait until then
+        self.stats = D(messages=0, lost=0, datagrams=0, bursts=0)
+
+    def produce(self, now: float, t: float) -> None:
+        args, rng = self.args, self.rng
+        if args.burst and now >= self.hold_until and rng.random() < args.burst:
+            self.hold_until = now + args.burst_length / args.rate
+            self.stats['bursts'] += 1
+        for prefix, curve in self.streams:
+            if args.loss and rng.random() < args.loss:
+                self.stats['lost'] += 1
+                continue
+            at = max(now, self.hold_until)
+            if args.jitter:
+                at += rng.uniform(0, args.jitter)
+            heappush(self.queue, (at, self.seq, prefix + pack('>f', curve.value(t))))
+            self.seq += 1
+
+    def due(self, now: float) -> list[bytes]:
+        queue = self.queue
+        messages = []
+        while queue and queue[0][0] <= now:
+            messages.append(heappop(queue)[2])
+        return messages
+
+    def send(self, transport, messages: list[bytes]) -> None:
+        self.stats['messages'] += len(messages)
+        n = self.args.bundle
+        if n > 1:
+            for i in range(0, len(messages), n):
+                transport.sendto(osc_bundle(messages[i:i+n]))
+                self.stats['datagrams'] += 1
+        else:
+            for m in messages:
+                transport.sendto(m)
+            self.stats['datagrams'] += len(messages)
+
+    async def run(self) -> dict:
+        args = self.args
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(args.host, args.port))
+        period = 1 / args.rate
+        start = perf_counter()
+        tick = 0
+        try:
+            while (now := perf_counter()) - start < args.duration or self.queue:
+                if now - start < args.duration and now >= start + tick * period:
+                    self.produce(now, now - start)
+                    tick += 1
+                self.send(transport, self.due(now))
+                # next tick or next delayed message
+                wake = start + tick * period
+                if self.queue:
+                    wake = min(wake, self.queue[0][0])
+                await asyncio.sleep(max(0, wake - perf_counter()))
+        finally:
+            transport.close()
+        elapsed = perf_counter() - start
+        return D(**self.stats, streams=len(self.streams), seconds=round(elapsed, 3),
+                 rate=round(self.stats['messages'] / elapsed, 1))
+
+
+def main():
+    parser = ArgumentParser(description="Stream synthetic OSC proximity curves for every actuator of a config")
+    parser.add_argument('config', type=str, nargs='?', default='config_sample.yaml')
+    parser.add_argument('--host', type=str, default=None, help="default: the game hostname of the config")
+    parser.add_argument('--port', type=int, default=None, help="default: the game receiving_port of the config")
+    parser.add_argument('--rate', type=float, default=30, help="updates per second per actuator")
+    parser.add_argument('--duration', type=float, default=10, help="seconds")
+    parser.add_argument('--mix', type=str, default='approach=0.5,rub=0.3,idle=0.2', help="curve weights")
+    parser.add_argument('--jitter', type=float, default=0, help="max random delay per message (seconds)")
+    parser.add_argument('--burst', type=float, default=0, help="chance per tick to stall then send everything at once")
+    parser.add_argument('--burst-length', type=int, default=10, help="ticks held by a burst")
+    parser.add_argument('--loss', type=float, default=0, help="ratio of messages dropped")
+    parser.add_argument('--bundle', type=int, default=1, help="messages per OSC bundle (1: no bundle)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    config = load_yaml(args.config)
+    game = (config.get('games') or {}).get('VRChat') or {}
+    args.host = args.host or game.get('hostname', '127.0.0.1')
+    args.port = args.port or game.get('receiving_port', 9001)
+    paths = discover(config)
+
+    stats = asyncio.run(LoadGenerator(args, paths).run())
+    print(f"{stats['streams']} actuators x {args.rate} Hz for {stats['seconds']}s to {args.host}:{args.port}", file=sys.stderr)
+    print(f"  messages {stats['messages']} ({stats['rate']}/s) in {stats['datagrams']} datagrams, "
+          f"lost {stats['lost']}, bursts {stats['bursts']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
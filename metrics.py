@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Minimal metrics: counters and fixed bucket histograms, cheap enough to always record,
+# rendered in Prometheus text format over a local HTTP endpoint on the asyncio loop
+
+import asyncio
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable
+
+# seconds, from sub-millisecond to a second
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.)
+
+
+class Counter:
+    __slots__ = ('value',)
+    def __init__(self):
+        self.value = 0
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    def __init__(self, buckets: tuple[float]):
+        self.buckets = buckets # upper bounds, +Inf implied
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+# value computed at scrape time, for state kept elsewhere
+class Func:
+    __slots__ = ('f',)
+    def __init__(self, f: Callable[[], float]):
+        self.f = f
+    @property
+    def value(self) -> float:
+        return self.f()
+
+
+# text format escaping: backslash and newline, double quote too in label values
+def escape(v, quotes: bool = False) -> str:
+    v = str(v).replace('\\', '\\\\').replace('\n', '\\n')
+    return v.replace('"', '\\"') if quotes else v
+
+
+class Registry:
+    def __init__(self, prefix: str = 'haptics_'):
+        self.prefix = prefix
+        self.families: dict[str, tuple] = {} # name -> (type, help, { labels: metric })
+
+    def get(self, kind: str, name: str, help: str, labels: dict, new: Callable):
+        name = self.prefix + name
+        family = self.families.get(name)
+        if family == None:
+            family = self.families[name] = (kind, help, {})
+        elif family[0] != kind:
+            raise Exception(f"Metric {name} already registered as {family[0]}")
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric == None:
+            metric = family[2][key] = new()
+        return metric
+
+    def counter(self, name: str, help: str = '', **labels) -> Counter:
+        return self.get('counter', name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str = '', buckets: tuple[float] = LATENCY_BUCKETS, **labels) -> Histogram:
+        return self.get('histogram', name, help, labels, lambda: Histogram(buckets))
+
+    def counter_func(self, name: str, f: Callable[[], float], help: str = '', **labels) -> None:
+        self.get('counter', name, help, labels, lambda: Func(f))
+
+    def gauge_func(self, name: str, f: Callable[[], float], help: str = '', **labels) -> None:
+        self.get('gauge', name, help, labels, lambda: Func(f))
+
+    def render(self) -> str:
+        def fmt(labels, extra=()):
+            labels = (*labels, *extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{escape(v, quotes=True)}"' for k, v in labels) + '}'
+
+        lines = []
+        for name, (kind, help, metrics) in self.families.items():
+            if help:
+                lines.append(f'# HELP {name} {escape(help)}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, m in metrics.items():
+                if kind == 'histogram':
+                    total = 0
+                    for le, n in zip((*m.buckets, '+Inf'), m.counts):
+                        total += n
+                        lines.append(f'{name}_bucket{fmt(labels, [("le", le)])} {total}')
+                    lines.append(f'{name}_sum{fmt(labels)} {m.sum}')
+                    lines.append(f'{name}_count{fmt(labels)} {m.count}')
+                else:
+                    lines.append(f'{name}{fmt(labels)} {m.value}')
+        return '\n'.join(lines) + '\n'
+
+    # GET /metrics, anything else is 404
+    async def serve(self, host: str = '127.0.0.1', port: int = 9101) -> asyncio.AbstractServer:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request = await reader.readuntil(b'\r\n\r\n')
+                path = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+                if path.split(b'?')[0] == b'/metrics':
+                    status, body = b'200 OK', self.render().encode()
+                else:
+                    status, body = b'404 Not Found', b'not found\n'
+                writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                             b'Content-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n'
+                             b'Connection: close\r\n\r\n' + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+        return await asyncio.start_server(handle, host, port)
+
+
+# measures how late the loop wakes up compared to when it should
+class LoopLagMonitor:
+    def __init__(self, registry: Registry, interval: float = 0.1):
+        self.interval = interval
+        self.lag = 0. # latest measure, seconds
+        self.histogram = registry.histogram('event_loop_lag_seconds', "Event loop wake up delay")
+        self.task: asyncio.Task = None
+
+    def start(self) -> None:
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+
+    async def run(self) -> None:
+        while True:
+            expected = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0., perf_counter() - expected)
+            self.histogram.observe(self.lag)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Hot path microbenchmark: memory per actuator and time per message from the OSC
+# path to the command handed to the connection, without sockets nor event loop wake ups.
+# Synthetic controllers (DakyProtocol) with a null connection, timers on a virtual clock.
+
+import asyncio, sys, json, tracemalloc, gc
+from time import perf_counter
+from argparse import ArgumentParser
+from config import load_yaml, reify_config
+from base import Connection, VirtualClock
+D = dict
+
+
+class Null(Connection):
+    async def send(self, data: bytes, key=None) -> None:
+        pass
+
+
+def build_config(args) -> dict:
+    config = load_yaml(args.config)
+    per_controller = args.actuators // args.controllers
+    config['setup'] = D(
+        router=D(prefix='/avatar/parameters/haptX-'),
+        behavior=D(type=args.behavior),
+        controllers=[ D(
+            name=f'bench{c}',
+            protocol=D(type='DakyProtocol'),
+            connection=D(type='UDP', address='127.0.0.1', port=1), # replaced, never connected
+            actuators={ i: D(name=f'bench{c}x{i}') for i in range(per_controller) },
+            ) for c in range(args.controllers) ],
+        )
+    return config
+
+
+async def run(args) -> dict:
+    config = build_config(args)
+    prefix = config['setup']['router']['prefix']
+    paths = [ prefix + a['name'] for c in config['setup']['controllers'] for a in c['actuators'].values() ]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    manager = reify_config('VRChat', config)
+    clock = manager.scheduler.clock = VirtualClock(1000)
+    manager.scheduler.virtual = True
+    for c in manager.controllers:
+        c.connection = Null()
+    for distance in (0.5, 0.4): # every actuator state exists, running
+        for path in paths:
+            clock.now += 0.0001
+            await manager.on_update(path, distance, clock.now)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # distinct values so dedup never kicks in, time moves on to expire throttles
+    values = [ i / 100 for i in range(100) ]
+    n, t = len(paths), clock.now
+    start = perf_counter()
+    for i in range(args.messages):
+        t += args.interval
+        clock.now = t
+        await manager.on_update(paths[i % n], values[i % 100], t)
+    elapsed = perf_counter() - start
+    await manager.scheduler.advance(t + 1)
+
+    return D(
+            actuators=n,
+            behavior=args.behavior,
+            messages=args.messages,
+            bytes_per_actuator=round(memory / n),
+            us_per_message=round(elapsed / args.messages * 1e6, 2),
+            )
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the per message hot path")
+    parser.add_argument('config', type=str, nargs='?', default='config_sample.yaml', help="for the game section")
+    parser.add_argument('--actuators', type=int, default=1000)
+    parser.add_argument('--controllers', type=int, default=10)
+    parser.add_argument('--behavior', type=str, default='VelocityBased')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--interval', type=float, default=0.0001, help="virtual seconds between messages")
+    parser.add_argument('--json', type=str, default=None, help="write results as json to file ('-' for stdout)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    if args.json == '-':
+        print(json.dumps(result))
+        return
+    if args.json:
+        with open(args.json, 'wt') as fd:
+            json.dump(result, fd, indent=2)
+    print(f"{result['actuators']} actuators, {result['behavior']}, {result['messages']} messages", file=sys.stderr)
+    print(f"  {result['bytes_per_actuator']} bytes/actuator, {result['us_per_message']} us/message", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# OSCQuery service: tells the game which OSC paths we consume so it only sends those.
+# A small HTTP server on the asyncio loop answers the host info and namespace queries,
+# and the service is advertised over mDNS (_oscjson._tcp and _osc._udp) when zeroconf
+# is installed. Ports are chosen by the system.
+
+import asyncio, json, socket, logging
+from urllib.parse import unquote
+try:
+    from zeroconf import ServiceInfo
+    from zeroconf.asyncio import AsyncZeroconf
+except ImportError:
+    AsyncZeroconf = None # optional, only needed for mDNS advertisement
+
+log = logging.getLogger('haptics.ingest')
+
+# node access, from the point of view of the client (the game)
+ACCESS_NONE, ACCESS_READ, ACCESS_WRITE = 0, 1, 2
+
+
+class OSCQuery:
+    def __init__(self, name: str, osc_ip: str, osc_port: int, host: str = '127.0.0.1'):
+        self.name = name
+        self.osc_ip = osc_ip
+        self.osc_port = osc_port # UDP port receiving the OSC messages
+        self.host = host # HTTP server
+        self.http_port: int = None
+        self.paths: list[str] = []
+        self.root = self.node('/')
+        self.server: asyncio.AbstractServer = None
+        self.zeroconf = None
+
+    @staticmethod
+    def node(path: str, **attributes) -> dict:
+        return dict(FULL_PATH=path, ACCESS=ACCESS_NONE, **attributes)
+
+    # advertised paths, float parameters the game writes to us
+    def update(self, paths: list[str]) -> None:
+        self.paths = sorted(paths)
+        root = self.node('/', DESCRIPTION=self.name)
+        for path in self.paths:
+            parent, parts = root, path.strip('/').split('/')
+            for i, part in enumerate(parts):
+                contents = parent.setdefault('CONTENTS', {})
+                full = '/' + '/'.join(parts[:i+1])
+                parent = contents.setdefault(part, self.node(full))
+            parent.update(ACCESS=ACCESS_WRITE, TYPE='f')
+        self.root = root
+
+    def host_info(self) -> dict:
+        return dict(
+                NAME=self.name,
+                OSC_IP=self.osc_ip,
+                OSC_PORT=self.osc_port,
+                OSC_TRANSPORT='UDP',
+                EXTENSIONS=dict(ACCESS=True, VALUE=False, RANGE=False, DESCRIPTION=True,
+                                TAGS=False, CLIPMODE=False, CRITICAL=False, LISTEN=False))
+
+    def find(self, path: str) -> dict:
+        node = self.root
+        for part in filter(None, path.split('/')):
+            node = node.get('CONTENTS', {}).get(part)
+            if node == None:
+                return None
+        return node
+
+    # (status, body) of a GET target, eg: /?HOST_INFO, /avatar/parameters, /x?TYPE
+    def query(self, target: str) -> tuple[bytes, dict]:
+        path, _, attribute = unquote(target).partition('?')
+        if attribute == 'HOST_INFO':
+            return b'200 OK', self.host_info()
+        node = self.find(path)
+        if node == None:
+            return b'404 Not Found', None
+        if not attribute:
+            return b'200 OK', node
+        if attribute in node:
+            return b'200 OK', { attribute: node[attribute] }
+        return b'204 No Content', None
+
+    async def start(self) -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request = await reader.readuntil(b'\r\n\r\n')
+                parts = request.split(b' ', 2)
+                status, body = self.query(parts[1].decode()) if len(parts) == 3 and parts[0] == b'GET' \
+                        else (b'400 Bad Request', None)
+                data = json.dumps(body).encode() if body != None else b''
+                writer.write(b'HTTP/1.1 ' + status + b'\r\n'
+                             b'Content-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(data)).encode() + b'\r\n'
+                             b'Connection: close\r\n\r\n' + data)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, UnicodeDecodeError):
+                pass
+            finally:
+                writer.close()
+        self.server = await asyncio.start_server(handle, self.host, 0)
+        self.http_port = self.server.sockets[0].getsockname()[1]
+        log.info("OSCQuery: http://%s:%d/ for OSC port %d", self.host, self.http_port, self.osc_port)
+        await self.advertise()
+
+    async def advertise(self) -> None:
+        if AsyncZeroconf is None:
+            log.warning("OSCQuery: zeroconf not installed (pip install zeroconf), not advertised over mDNS")
+            return
+        address = socket.inet_aton(self.host)
+        self.zeroconf = AsyncZeroconf(interfaces=[self.host])
+        for kind, port in (('_oscjson._tcp.local.', self.http_port), ('_osc._udp.local.', self.osc_port)):
+            await self.zeroconf.async_register_service(ServiceInfo(
+                    kind, f"{self.name}.{kind}",
+                    addresses=[address], port=port, server=f"{self.name}.local."))
+
+    async def stop(self) -> None:
+        if self.zeroconf:
+            await self.zeroconf.async_unregister_all_services()
+            await self.zeroconf.async_close()
+            self.zeroconf = None
+        if self.server:
+            self.server.close()
+            self.server = None
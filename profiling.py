@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Opt-in profiling of the hot path: stage methods are wrapped with timers only when
+# enabled (nothing changes otherwise), and an optional thread samples the event loop
+# stacks into collapsed stacks ("a;b;c count" lines) that flamegraph tools read.
+# Stage times are inclusive: a stage calling another one counts it too.
+
+import sys, os, threading, inspect
+from collections import Counter
+from functools import wraps
+from time import perf_counter
+from pythonosc.dispatcher import Dispatcher
+import base
+
+
+class StageTimers:
+    def __init__(self):
+        self.stats: dict[str, list] = {} # stage -> [calls, total seconds, max seconds]
+        self.patched: list[tuple] = [] # (owner, name, original) to restore
+
+    def wrap(self, owner: type, name: str, stage: str) -> None:
+        original = getattr(owner, name, None)
+        if original == None or any(o == owner and n == name for o, n, _ in self.patched):
+            return
+        stats = self.stats.setdefault(stage, [0, 0., 0.])
+        if inspect.iscoroutinefunction(original):
+            @wraps(original)
+            async def timed(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    dt = perf_counter() - start
+                    stats[0] += 1
+                    stats[1] += dt
+                    if dt > stats[2]: stats[2] = dt
+        else:
+            @wraps(original)
+            def timed(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    dt = perf_counter() - start
+                    stats[0] += 1
+                    stats[1] += dt
+                    if dt > stats[2]: stats[2] = dt
+        self.patched.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, timed)
+
+    def restore(self) -> None:
+        for owner, name, original in reversed(self.patched):
+            if original == None:
+                delattr(owner, name) # was inherited
+            else:
+                setattr(owner, name, original)
+        self.patched = []
+
+
+# samples the stack of one thread (the event loop) at a fixed interval
+class Sampler:
+    def __init__(self, interval: float, thread_id: int):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter() # collapsed stack -> samples
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame != None:
+                code = frame.f_code
+                stack.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path: str) -> None:
+        with open(path, 'wt') as fd:
+            for stack, n in self.stacks.most_common():
+                fd.write(f"{stack} {n}\n")
+
+    # functions on top of the stack
+    def top(self, n: int) -> list[tuple[str, int]]:
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(n)
+
+
+class Profiler:
+    def __init__(self, sample: float = None):
+        self.timers = StageTimers()
+        self.sample = sample # seconds between stack samples, None: no sampling
+        self.sampler: Sampler = None
+        self.start: float = None
+
+    # from the event loop thread, once the manager is built
+    def install(self, manager: 'base.Manager') -> None:
+        wrap = self.timers.wrap
+        wrap(base.OSCIngest, 'datagram_received', 'ingest') # fast_ingest
+        wrap(Dispatcher, 'call_handlers_for_packet', 'ingest') # python-osc
+        wrap(base.Manager, 'on_update', 'manager')
+        wrap(base.Manager, 'on_route', 'manager')
+        wrap(base.Router, 'resolve_path', 'router')
+        for name in ('on_update', 'step'):
+            wrap(type(manager.behavior), name, 'behavior')
+        for name in ('actuate_mapped', 'flush', 'flush_frame'):
+            wrap(base.Controller, name, 'controller')
+        if manager.virtual:
+            wrap(base.VirtualController, 'flush', 'virtual')
+        for c in manager.controllers:
+            for name in ('actuation', 'actuations', 'frame'):
+                wrap(type(c.protocol), name, 'protocol')
+            wrap(type(c.connection), 'send', 'connection')
+
+        self.start = perf_counter()
+        if self.sample:
+            self.sampler = Sampler(self.sample, threading.get_ident())
+            self.sampler.start()
+
+    def stop(self) -> None:
+        if self.start == None:
+            return # never installed
+        self.elapsed = perf_counter() - self.start
+        self.timers.restore()
+        if self.sampler:
+            self.sampler.stop()
+
+    def report(self, out=sys.stderr) -> None:
+        if self.start == None:
+            return
+        print(f"profile over {self.elapsed:.1f}s (inclusive times)", file=out)
+        print(f"  {'stage':<12}{'calls':>10}{'total ms':>12}{'mean us':>10}{'max us':>10}{'% wall':>8}", file=out)
+        for stage, (calls, total, max_) in self.timers.stats.items():
+            if not calls:
+                continue
+            print(f"  {stage:<12}{calls:>10}{total*1e3:>12.1f}{total/calls*1e6:>10.1f}{max_*1e6:>10.0f}"
+                  f"{total/self.elapsed*100:>8.2f}", file=out)
+        if self.sampler:
+            total = sum(self.sampler.stacks.values())
+            print(f"  {total} samples, on top of the stack:", file=out)
+            for name, n in self.sampler.top(10):
+                print(f"  {n/max(total, 1)*100:6.1f}% {name}", file=out)
+
+    def write(self, path: str) -> bool:
+        if not self.sampler:
+            return False
+        self.sampler.write(path)
+        return True
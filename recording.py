@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Session recording of incoming updates, compact append-only binary log.
+# File: header then fixed-width records of 16 bytes:
+# - sample:     timestamp: float64, path id: uint32, value: float32
+# - definition: timestamp: float64, DEFINE: uint32, length: uint32
+#               followed by the path (utf8) padded to 16 bytes, its id is the next one
+
+import os, mmap
+from struct import Struct
+
+MAGIC = b'DKHREC1\0'.ljust(16, b'\0')
+SAMPLE = Struct('<dIf')
+DEFINITION = Struct('<dII')
+RECORD_SIZE = 16
+DEFINE = 0xFFFFFFFF
+
+
+def padded(n: int) -> int:
+    return (n + RECORD_SIZE - 1) // RECORD_SIZE * RECORD_SIZE
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self.ids: dict[str, int] = {}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # appending, learn the existing paths
+            for _, p in read_definitions(path):
+                self.ids[p] = len(self.ids)
+            self.fd = open(path, 'ab')
+        else:
+            self.fd = open(path, 'ab')
+            self.fd.write(MAGIC)
+
+    def record(self, t: float, path: str, value: float) -> None:
+        id = self.ids.get(path)
+        if id == None:
+            id = self.ids[path] = len(self.ids)
+            data = path.encode()
+            self.fd.write(DEFINITION.pack(t, DEFINE, len(data)))
+            self.fd.write(data.ljust(padded(len(data)), b'\0'))
+        self.fd.write(SAMPLE.pack(t, id, value))
+
+    def close(self) -> None:
+        self.fd.close()
+
+
+def read_records(path: str, definitions: bool = False):
+    with open(path, 'rb') as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if m[:RECORD_SIZE] != MAGIC:
+            raise Exception(f"{path} isn't a recording")
+        paths: list[str] = []
+        i = RECORD_SIZE
+        while i + RECORD_SIZE <= len(m):
+            t, id, value = SAMPLE.unpack_from(m, i)
+            i += RECORD_SIZE
+            if id == DEFINE:
+                (_, _, length) = DEFINITION.unpack_from(m, i - RECORD_SIZE)
+                paths.append(m[i:i+length].decode())
+                i += padded(length)
+                if definitions:
+                    yield t, paths[-1]
+            elif not definitions:
+                yield t, paths[id], value
+
+# (timestamp, path) of each path definition
+def read_definitions(path: str):
+    return read_records(path, definitions=True)
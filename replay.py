@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Replay a recorded session through the router and behavior of a config,
+# outputs the resulting actuation stream: timestamp controller command (hex)
+
+import asyncio, sys, random
+from itertools import chain
+from argparse import ArgumentParser
+from time import time
+from config import load_config
+from recording import read_records
+from base import Connection, VirtualClock, np
+
+
+class Capture(Connection):
+    def __init__(self, name: str, clock, origin: float, out):
+        self.name, self.clock, self.origin, self.out = name, clock, origin, out
+    async def send(self, data: bytes, key=None) -> None:
+        self.out.write(f"{self.clock() - self.origin:.6f} {self.name} {data.hex()}\n")
+
+
+async def replay(args, out) -> None:
+    manager = load_config('VRChat', args.config)
+    scheduler = manager.scheduler
+    # random throttles draw the same values: two runs give the same output
+    random.seed(args.seed)
+    if hasattr(manager.behavior, 'rng'):
+        manager.behavior.rng = np.random.default_rng(args.seed)
+    records = read_records(args.recording)
+    first = next(records, None)
+    if first == None:
+        return # empty
+    origin = first[0]
+
+    if args.fast:
+        scheduler.clock = VirtualClock(origin)
+        scheduler.virtual = True
+    else:
+        shift = time() - origin
+        scheduler.clock = lambda: time() - shift # keep recorded timestamps
+    for c in manager.controllers:
+        c.connection = Capture(c.name, scheduler.clock, origin, out)
+    await manager.behavior.start()
+
+    last = origin
+    for t, path, value in chain([first], records):
+        if args.fast:
+            await scheduler.advance(t)
+        elif (delay := t - scheduler.clock()) > 0:
+            await asyncio.sleep(delay)
+        await manager.on_update(path, value)
+        last = t
+
+    # let timeouts and throttles finish
+    if args.fast:
+        await scheduler.advance(last + args.tail)
+    else:
+        await asyncio.sleep(args.tail)
+    await manager.behavior.stop()
+
+
+def main():
+    parser = ArgumentParser(description="Replay a recorded session")
+    parser.add_argument('config', type=str)
+    parser.add_argument('recording', type=str)
+    parser.add_argument('--fast', action='store_true', help="as fast as possible using a virtual clock")
+    parser.add_argument('--tail', type=float, default=2, help="seconds to run after the last update")
+    parser.add_argument('--seed', type=int, default=0, help="of the random throttles")
+    parser.add_argument('--out', type=str, default=None, help="actuation stream output file (default: stdout)")
+    args = parser.parse_args()
+
+    out = open(args.out, 'wt') if args.out else sys.stdout
+    try:
+        asyncio.run(replay(args, out))
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
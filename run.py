@@ -1,22 +1,78 @@
 #!/usr/bin/env python3
 
-import asyncio, sys, traceback
-from config import load_config
+import asyncio, sys, os, signal, traceback, logging
+from config import load_yaml, reify_config, load_config
+from recording import Recorder
+from profiling import Profiler
+from utils import setup_logging
 from argparse import ArgumentParser
 
 parser = ArgumentParser()
 parser.add_argument('config', type=str)
+parser.add_argument('--record', type=str, default=None, help="append incoming updates to this file")
+parser.add_argument('--log-level', type=str, default=None, help="overrides logging.level of the config")
+parser.add_argument('--log', type=str, action='append', default=[], help="subsystem level, eg: behavior=DEBUG")
+parser.add_argument('--metrics-port', type=int, default=None, help="serve metrics on this port (overrides config)")
+parser.add_argument('--watch', action='store_true', help="reload the config when the file changes (SIGHUP reloads too)")
+parser.add_argument('--profile', action='store_true', help="time each hot path stage, summary on exit")
+parser.add_argument('--profile-sample', type=float, default=None, metavar='SECONDS',
+                    help="with --profile, also sample the event loop stacks at this interval (eg: 0.001)")
+parser.add_argument('--profile-out', type=str, default='profile.folded', help="collapsed stacks of the samples")
 args = parser.parse_args()
 
+config = load_yaml(args.config)
+c_log = config.get('logging') or {}
+log_listener = setup_logging(
+        level=args.log_level or c_log.get('level', 'INFO'),
+        levels={ **(c_log.get('levels') or {}), **dict(l.split('=', 1) for l in args.log) })
+log = logging.getLogger('haptics')
+profiler = Profiler(args.profile_sample) if args.profile else None
+
 async def main():
-    manager = load_config('VRChat', args.config)
+    manager = reify_config('VRChat', config)
+    if args.record:
+        manager.recorder = Recorder(args.record)
+    if profiler:
+        profiler.install(manager)
 
     router = manager.router
-    print("controllers:", list(router.name_to_controller.keys()))
+    log.info("controllers: %s", list(router.name_to_controller.keys()))
+
+    c_metrics = config.get('metrics') or {}
+    if (port := args.metrics_port or c_metrics.get('port')):
+        host = c_metrics.get('host', '127.0.0.1')
+        await manager.metrics.serve(host, port)
+        log.info("metrics: http://%s:%d/metrics", host, port)
+
+    async def reload():
+        try:
+            await manager.reload(load_config('VRChat', args.config))
+        except Exception as e:
+            log.error("reload failed, keeping the current config: %s", e)
+    loop = asyncio.get_event_loop()
+    if hasattr(signal, 'SIGHUP'): # not on windows
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(reload()))
+    if args.watch:
+        loop.create_task(watch(args.config, reload))
 
     await manager.start()
 
 
+# polls the modification time, no dependency and good enough for a hand edited file
+async def watch(path: str, on_change, interval: float = 1):
+    mtime = os.stat(path).st_mtime
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if (m := os.stat(path).st_mtime) == mtime:
+                continue
+        except OSError:
+            continue # being replaced by the editor
+        mtime = m
+        log.info("%s changed, reloading", path)
+        await on_change()
+
+
 def handle_exception(loop, context):
    if (exc := context.get("exception")):
        print(''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)), file=sys.stderr)
@@ -31,3 +87,9 @@ try:
    loop.run_until_complete(main())
 finally:
    loop.close()
+   if profiler:
+       profiler.stop()
+       profiler.report()
+       if profiler.write(args.profile_out):
+           log.info("collapsed stacks written to %s (flamegraph.pl, speedscope...)", args.profile_out)
+   log_listener.stop()
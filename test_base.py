@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# unit tests of base.py stages, run with: python -m pytest test_base.py
+
+from base import *
+
+
+def test_limiter_preempted_update_not_sent():
+    limiter = Limiter(1)
+    assert limiter.request('a', 0.5, 1) == [('a', 0.5)]
+    assert limiter.request('b', 0.4, 2) == [] # denied
+    # a falls below b: stopped, b takes its slot, the new a value isn't sent
+    assert limiter.request('a', 0.2, 3) == [('a', 0.), ('b', 0.4)]
+    assert limiter.active == {'b'}
+    assert limiter.request('b', 0, 4) == [('a', 0.2), ('b', 0)] # restored
+
+
+def test_limiter_slot_taken_by_intensity():
+    # actuator with min > 0: intensity 0 is mapped to min, the slot is still released
+    limiter = Limiter(1)
+    assert limiter.request('a', 0.6, 1, intensity=0.5) == [('a', 0.6)]
+    assert limiter.request('a', 0.2, 2, intensity=0) == [('a', 0.2)]
+    assert limiter.active == set()
+    assert limiter.request('b', 0.7, 3, intensity=0.6) == [('b', 0.7)]
+    assert limiter.request('a', 0.2, 4, intensity=0) == [] # not running, nothing to stop
+
+
+# stands for the controller of a route, records what reaches it
+class Recorder:
+    def __init__(self):
+        self.sent = []
+    async def actuate_mapped(self, address, value, intensity=None):
+        self.sent.append(round(value, 6))
+    async def actuate(self, address, value):
+        self.sent.append(round(value, 6))
+
+
+def test_waveform_sum_mixes_levels_before_map():
+    behavior = WaveformBased(effects=D(tap=D(duration=0.02, level=0.3)), effect='tap', mix='sum')
+    behavior.scheduler = Scheduler(VirtualClock())
+    behavior.scheduler.virtual = True
+    controller = Recorder()
+    route = Route(0, '/tap', controller, 0, Actuator('tap', min=0.2, max=1.))
+    behavior.compile([route])
+
+    async def play():
+        await behavior.on_update(route, 0.5)
+        await behavior.on_update(route, 1) # released, plays until its end
+        await behavior.on_update(route, 0.5) # second voice over the first
+        await behavior.scheduler.advance(0.05)
+    asyncio.run(play())
+    # 0.3 + 0.3 mapped once into 0.2-1, then stopped
+    assert controller.sent == [0.68, 0.68, 0.]
+
+
+def test_serial_ports_shared_across_timeouts():
+    import base
+    async def run():
+        loop = asyncio.get_running_loop()
+        base._ports = (perf_counter(), loop.create_future()) # enumeration in progress
+        ports = base._ports[1]
+        try:
+            await asyncio.wait_for(list_serial_ports(loop), 0.01)
+        except asyncio.TimeoutError:
+            pass
+        assert not ports.cancelled() # still shared with the others
+        waiting = loop.create_task(list_serial_ports(loop))
+        await asyncio.sleep(0)
+        ports.set_result(['port'])
+        assert await waiting == ['port']
+
+        base._ports = (perf_counter(), loop.create_future())
+        base._ports[1].cancel()
+        try:
+            await list_serial_ports(loop)
+        except asyncio.CancelledError:
+            pass
+        assert base._ports == (0, None) # not cached
+    asyncio.run(run())
+
+
+def test_ingest_malformed_bundle_dropped():
+    received = []
+    ingest = OSCIngest(Registry(), lambda: 0.)
+    ingest.prefix = b'/a'
+    ingest.routes = { b'/ab': 'ab' }
+    ingest.callback = lambda target, value, at: received.append((target, value))
+    message = b'/ab\0,f\0\0' + pack('>f', 0.5)
+    bundle = b'#bundle\0' + bytes(8) + pack('>i', len(message)) + message
+    ingest.parse(bundle + pack('>i', -4) + message, 0.) # would never move forward
+    ingest.parse(bundle + pack('>i', 100) + message, 0.) # past the end
+    assert received == [('ab', 0.5), ('ab', 0.5)]
+
+
+def test_dedup_forgets_commands_dropped_by_outbox():
+    written = []
+    connection = Connection(max_pending=1)
+    connection.new_outbox().write = written.append
+    controller = Controller('c', { 0: Actuator('a'), 1: Actuator('b') }, DakyProtocol(), connection)
+    controller.scheduler = Scheduler(VirtualClock())
+    controller.bind_outbox()
+
+    async def run():
+        connection.outbox.pause()
+        await controller.actuate_mapped(0, 1.)
+        await controller.actuate_mapped(1, 1.) # drops the first one
+        assert controller.sent.value == 0 # held, not written yet
+        connection.outbox.resume()
+        await controller.actuate_mapped(0, 1.) # same value, sent again
+    asyncio.run(run())
+    assert written == [b'B\x01\xff', b'B\x00\xff']
+    assert controller.sent.value == 2
+
+
+def test_numpy_velocity_parks_when_idle():
+    behavior = VelocityBasedNumpy(timeout=0.05)
+    behavior.scheduler = scheduler = Scheduler(VirtualClock())
+    scheduler.virtual = True
+    controller = Recorder()
+    route = Route(0, '/a', controller, 0, Actuator('a', min_sensitivity=1.))
+    behavior.compile([route])
+    ticking = lambda: scheduler.pending(('tick', id(behavior)))
+
+    async def run():
+        await behavior.start()
+        await scheduler.advance(0.1)
+        assert not ticking() # nothing to do
+        await behavior.on_update(route, 1., 0.1) # full speed, reaches min_sensitivity 1
+        assert ticking()
+        await scheduler.advance(1)
+        assert not ticking() # stopped after the timeout
+    asyncio.run(run())
+    assert controller.sent == [1., 0.]
+
+
+# connection of a controller, records what it sends
+class Sent(Connection):
+    def __init__(self):
+        self.sent = []
+    async def send(self, data: bytes, key=None) -> None:
+        self.sent.append(data)
+
+
+def test_reload_other_behavior_turns_off_running_actuators():
+    from config import reify_config
+    def config(behavior):
+        return D(games=D(VRChat=D()), setup=D(
+            router=D(prefix='/p-'),
+            behavior=D(type=behavior),
+            controllers=[ D(name='c', protocol=D(type='DakyProtocol'),
+                            connection=D(type='UDP', address='127.0.0.1', port=1),
+                            actuators={ 0: D(name='a') }) ]))
+
+    async def run():
+        manager = reify_config('VRChat', config('ProximityBased'))
+        connection = manager.controllers[0].connection = Sent()
+        await manager.on_update('/p-a', 0.2)
+        new = reify_config('VRChat', config('VelocityBased'))
+        new.controllers[0].connection = connection # unchanged
+        await manager.reload(new)
+        return connection.sent
+    assert asyncio.run(run()) == [b'B\x00\xcc', b'B\x00\x00']
+
+
+def test_outbox_overwritten_data_written_last():
+    written = []
+    outbox = Outbox(8)
+    outbox.write = written.append
+    outbox.pause()
+    outbox.send(b'old', 0)
+    outbox.send(b'batch') # unkeyed, also sets address 0
+    outbox.send(b'new', 0)
+    outbox.resume()
+    assert written == [b'batch', b'new']
+
+
+def test_scheduler_failing_callback_doesnt_stop_others():
+    fired, errors = [], []
+    async def fail():
+        raise Exception("broken")
+    async def timeout():
+        fired.append('timeout')
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        scheduler = Scheduler()
+        now = scheduler.clock()
+        scheduler.schedule('a', now, fail)
+        scheduler.schedule('b', now, timeout)
+        await asyncio.sleep(0.05)
+    asyncio.run(run())
+    assert fired == ['timeout']
+    assert len(errors) == 1
+
+
+def test_senseshift_frame_size_limit():
+    protocol = SenseShiftProtocol(motors=253, depth=8)
+    frame = protocol.frame([1.] * 253)
+    assert len(frame) == 255 and frame[:2] == b'F\xfd' and frame[2:] == b'\xff' * 253
+    try:
+        SenseShiftProtocol(motors=254, depth=8)
+        assert False, "over the serial packet size"
+    except Exception as e:
+        assert '256 bytes' in str(e)
+    protocol = SenseShiftProtocol(motors=255, depth=4)
+    frame = protocol.frame([1.] * 254 + [0.5])
+    assert len(frame) == 130 and frame[-1] == 0x80 # last motor high nibble, padding low
+
+
+def test_smoothing_parameters_validated():
+    for kind, kwargs in ((Window, D(size=0)), (EMA, D(alpha=0)), (EMA, D(alpha=1.5)), (PeakHold, D(decay=-0.1))):
+        try:
+            kind(**kwargs)
+            assert False, f"{kind.__name__} {kwargs} accepted"
+        except Exception as e:
+            assert kind.__name__ in str(e)
+    peak = PeakHold(decay=0) # only the latest sample, not "no decay"
+    peak.add(0.8)
+    peak.add(0.3)
+    assert peak.value() == 0.3
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+# unit tests of metrics.py, run with: python -m pytest test_metrics.py
+
+from metrics import Registry
+
+
+def test_render_escapes_label_values():
+    registry = Registry()
+    registry.counter('errors_total', "Errors\nby controller", controller='a"b\\c\nd').inc()
+    assert registry.render() == (
+        '# HELP haptics_errors_total Errors\\nby controller\n'
+        '# TYPE haptics_errors_total counter\n'
+        'haptics_errors_total{controller="a\\"b\\\\c\\nd"} 1\n')
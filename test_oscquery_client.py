@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+# Stands in for the game: reads the OSCQuery service (http port printed at startup)
+# and only sends to the advertised parameters, like VRChat does.
+
+import sys, json
+from urllib.request import urlopen
+from pythonosc.udp_client import SimpleUDPClient
+
+
+host = "127.0.0.1"
+http_port = int(sys.argv[1])
+
+def get(target):
+    with urlopen(f"http://{host}:{http_port}{target}") as response:
+        return json.load(response)
+
+def leaves(node):
+    if 'TYPE' in node:
+        yield node['FULL_PATH']
+    for child in node.get('CONTENTS', {}).values():
+        yield from leaves(child)
+
+info = get('/?HOST_INFO')
+paths = list(leaves(get('/')))
+print(info['NAME'], 'OSC', info['OSC_IP'], info['OSC_PORT'], paths)
+
+client = SimpleUDPClient(info['OSC_IP'], info['OSC_PORT'])
+
+def send(path, value):
+    client.send_message(path, value)
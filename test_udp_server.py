@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 import socket
-from struct import unpack
+from struct import unpack, pack
 from collections import defaultdict
 from types import SimpleNamespace as N
 
@@ -16,18 +16,39 @@ def str_sub(s, idx, c):
     return s[:idx] + str(c) + s[idx+1:]
 strength_str_len = 51
 
+def actuate(addr, v):
+    i = infos[addr]
+    i.max = max(v, i.max)
+    v_str_scaled = v_str_scale(v)
+    strength_str = ('*'*v_str_scaled) + (' '*(strength_str_len - v_str_scaled + 1))
+    strength_str = str_sub(strength_str, v_str_scale(i.max), '>')
+    print(f"actuate #{addr: 2d}: {v: 3d} |{strength_str}|")
+    i.last = v
+
 while True:
     data, addr = sock.recvfrom(4096)
 
     if data.startswith(b'B'):
         _, addr, v = unpack('<cBB', data)
-        i = infos[addr]
-        i.max = max(v, i.max)
-        v_str_scaled = v_str_scale(v)
-        strength_str = ('*'*v_str_scaled) + (' '*(strength_str_len - v_str_scaled + 1))
-        strength_str = str_sub(strength_str, v_str_scale(i.max), '>')
-        print(f"actuate #{addr: 2d}: {v: 3d} |{strength_str}|")
-        i.last = v
+        actuate(addr, v)
+
+    elif data.startswith(b'M'): # batched
+        for i in range(data[1]):
+            actuate(data[2+2*i], data[3+2*i])
+
+    elif data.startswith(b'F'): # whole frame (SenseShiftProtocol), only changed motors shown
+        count, payload = data[1], data[2:]
+        if len(payload) == count: # depth 8
+            levels = list(payload)
+        else: # depth 4, two motors per byte
+            levels = [ x for b in payload for x in (b >> 4, b & 0xf) ][:count]
+            levels = [ v * 17 for v in levels ] # 0-255 like other commands
+        for addr, v in enumerate(levels):
+            if v != infos[addr].last:
+                actuate(addr, v)
+
+    elif data.startswith(b'%'): # battery query, also used as round trip probe
+        sock.sendto(b'%' + pack('<H', 3700), addr)
 
     else:
         print(f"Received message from {addr}: {data}")
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-import asyncio
+import asyncio, logging, queue
 import sys, traceback, functools
+from logging.handlers import QueueHandler, QueueListener
 from typing import Awaitable
 
 def remap(v, in1, in2, out1, out2, clamp=False):
@@ -23,3 +24,54 @@ def remove_keys(d, *keys):
 async def delayed_async(delay: float, f: Awaitable) -> None:
     await asyncio.sleep(delay)
     await f
+
+
+# run a coroutine synchronously until it suspends, only then continue it as a task
+# avoids a task per call when the coroutine finishes without waiting (hot path)
+def run_eager(coro: Awaitable) -> None:
+    try:
+        fut = coro.send(None)
+    except StopIteration:
+        return
+    asyncio.get_event_loop().create_task(_resume(coro, fut))
+
+class _Resumed:
+    def __init__(self, coro, fut):
+        self.coro, self.fut = coro, fut
+    def __await__(self): # proxy the rest of the coroutine to the task
+        coro, fut = self.coro, self.fut
+        while True:
+            try:
+                try:
+                    value = yield fut
+                except BaseException as e:
+                    fut = coro.throw(e)
+                else:
+                    fut = coro.send(value)
+            except StopIteration as e:
+                return e.value
+
+async def _resume(coro, fut):
+    return await _Resumed(coro, fut)
+
+
+# formatting happens in the listener thread, not on the caller
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# levels: per subsystem level, eg: { ingest: DEBUG } for logger haptics.ingest
+# records are queued and written by a thread so the event loop never blocks on output
+def setup_logging(level: str = 'INFO', levels: dict[str, str] = {}, format: str = '%(asctime)s %(levelname)s %(name)s: %(message)s') -> QueueListener:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(format))
+    q = queue.SimpleQueue()
+    listener = QueueListener(q, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [ DeferredQueueHandler(q) ]
+    logging.getLogger('haptics').setLevel(level.upper())
+    for name, l in levels.items():
+        logging.getLogger(f'haptics.{name}').setLevel(l.upper())
+    listener.start()
+    return listener